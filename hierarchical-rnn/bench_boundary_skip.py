@@ -0,0 +1,40 @@
+import argparse
+import time
+import numpy as np
+from hmlstm import NumpyHMLSTM, CorpusStreams, load_ids
+
+# Runs NumpyHMLSTM over PTB with and without skip_copies, and reports the
+# share of upper-layer rows skipped, the speedup and the agreement of the
+# two.
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--variable_path', default='./text8')
+parser.add_argument('--text_path', default='../treebank/corpora/sentences.txt')
+parser.add_argument('--batch_size', type=int, default=32)
+parser.add_argument('--truncate_len', type=int, default=1000)
+parser.add_argument('--num_chunks', type=int, default=5)
+options = parser.parse_args()
+
+engine = NumpyHMLSTM.load(options.variable_path)
+streams = CorpusStreams(load_ids(options.text_path), options.batch_size,
+                        options.truncate_len)
+
+dense_time = skip_time = skipped = total = 0.
+for _, batch in zip(range(options.num_chunks), streams.inputs):
+    start = time.time()
+    predictions, indicators = engine.run(batch)
+    dense_time += time.time() - start
+
+    start = time.time()
+    skip_predictions, skip_indicators = engine.run(batch, skip_copies=True)
+    skip_time += time.time() - start
+    skipped += engine.skip_ratio * batch.size
+    total += batch.size
+
+    print('max |prediction difference| %g, indicator agreement %.6f, '
+          'skip ratio %.3f' % (
+              np.max(np.abs(predictions - skip_predictions)),
+              np.mean(indicators == skip_indicators), engine.skip_ratio))
+
+print('skip ratio %.3f: %.3fs dense, %.3fs skipping copies (%.2fx)' % (
+    skipped / total, dense_time, skip_time, dense_time / skip_time))
@@ -0,0 +1,43 @@
+import argparse
+import numpy as np
+import tensorflow as tf
+from hmlstm import HMLSTMNetwork
+from bench_train import time_train_steps, report
+
+# Compares the CPU training throughput of FusedHMLSTMCell and of the
+# MultiHMLSTMCell of HMLSTMCells. That both compute the same outputs and
+# gradients is tested in tests/test_fused_hmlstm_cell.py.
+
+
+def build(fused, options):
+    graph = tf.Graph()
+    with graph.as_default():
+        network = HMLSTMNetwork(output_size=27, input_size=27,
+                                num_layers=options.num_layers,
+                                embed_size=options.hidden_size * 2,
+                                out_hidden_size=options.hidden_size,
+                                hidden_state_sizes=options.hidden_size,
+                                task='classification', char_ids=True,
+                                fused_cell=fused)
+        network._get_graph()
+    return graph, network
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--num_layers', type=int, default=3)
+parser.add_argument('--hidden_size', type=int, default=512)
+parser.add_argument('--batch_size', type=int, default=15)
+parser.add_argument('--truncate_len', type=int, default=1000)
+parser.add_argument('--steps', type=int, default=10)
+options = parser.parse_args()
+
+ids = np.random.randint(0, 27, size=(options.steps + 3, options.batch_size,
+                                     options.truncate_len + 1))
+batches_in, batches_out = ids[:, :, :-1], ids[:, :, 1:]
+
+for name, fused in (('reference', False), ('fused', True)):
+    graph, network = build(fused, options)
+    with graph.as_default():
+        times = time_train_steps(network, batches_in, batches_out,
+                                 options.steps)
+    report(name, times, options.batch_size, options.truncate_len)
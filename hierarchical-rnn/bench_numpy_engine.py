@@ -0,0 +1,90 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+
+# Compares NumpyHMLSTM with HMLSTMNetwork.predict / predict_boundaries on a
+# trained checkpoint, and the cold start time of both in a fresh process,
+# and of FrozenHMLSTM if the checkpoint was exported with export_graph.py.
+# That the outputs match within tolerance is tested in
+# tests/test_numpy_engine.py; this script also fails if they do not on the
+# checkpoint at hand.
+
+NUMPY_START = '''
+import time
+start = time.time()
+from hmlstm import NumpyHMLSTM
+NumpyHMLSTM.load(%r)
+print(time.time() - start)
+'''
+
+TF_START = '''
+import time
+start = time.time()
+from configuration import YamlParams
+network = YamlParams('config.yml', %r).gen_network()
+network._get_graph()
+network.load_variables(%r)
+print(time.time() - start)
+'''
+
+FROZEN_START = '''
+import time
+start = time.time()
+from hmlstm import FrozenHMLSTM
+FrozenHMLSTM(%r)
+print(time.time() - start)
+'''
+
+
+def cold_start(code):
+    return float(subprocess.check_output([sys.executable, '-c', code]))
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--config', default='default',
+                    help='configuration in config.yml of the checkpoint')
+parser.add_argument('--variable_path', default='./text8')
+parser.add_argument('--frozen_path', default='./text8.pb')
+parser.add_argument('--text_path', default='../treebank/corpora/sentences.txt')
+parser.add_argument('--num_batches', type=int, default=5)
+options = parser.parse_args()
+
+print('cold start: %.3fs numpy, %.3fs tensorflow' % (
+    cold_start(NUMPY_START % options.variable_path),
+    cold_start(TF_START % (options.config, options.variable_path))))
+if os.path.exists(options.frozen_path):
+    print('cold start: %.3fs frozen graph' % cold_start(
+        FROZEN_START % options.frozen_path))
+
+from hmlstm import NumpyHMLSTM
+from configuration import YamlParams
+
+hparams = YamlParams('config.yml', options.config)
+batches_in, _ = hparams.pre_inputs(options.text_path, train=False)
+network = hparams.gen_network()
+engine = NumpyHMLSTM.load(options.variable_path)
+
+tf_time = numpy_time = 0.
+for batch in batches_in[:options.num_batches]:
+    start = time.time()
+    predictions, indicators = network.infer(
+        batch, ('predictions', 'indicators'),
+        variable_path=options.variable_path)
+    tf_time += time.time() - start
+
+    start = time.time()
+    np_predictions, np_indicators = engine.run(batch)
+    numpy_time += time.time() - start
+
+    print('max |prediction difference| %g, indicator agreement %.6f' % (
+        np.max(np.abs(predictions - np_predictions)),
+        np.mean(indicators == np_indicators)))
+    np.testing.assert_array_equal(np_indicators, indicators)
+    np.testing.assert_allclose(np_predictions, predictions,
+                               rtol=1e-4, atol=1e-4)
+
+print('%d batches: %.3fs numpy, %.3fs tensorflow (incl. first run)' % (
+    min(options.num_batches, len(batches_in)), numpy_time, tf_time))
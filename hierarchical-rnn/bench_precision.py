@@ -0,0 +1,60 @@
+import argparse
+import time
+import numpy as np
+from configuration import YamlParams
+
+# Evaluates a trained checkpoint on PTB in float32 and in reduced
+# precisions, see HMLSTMNetwork.infer, and reports the indicator agreement
+# and the BPC change against float32 along with the throughput.
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--config', default='default',
+                    help='configuration in config.yml of the checkpoint')
+parser.add_argument('--variable_path', default='./text8')
+parser.add_argument('--text_path', default='../treebank/corpora/sentences.txt')
+parser.add_argument('--precisions', nargs='+', default=['float16', 'bfloat16'])
+parser.add_argument('--num_chunks', type=int, default=5)
+options = parser.parse_args()
+
+hparams = YamlParams('config.yml', options.config)
+streams = hparams.eval_streams(options.text_path)
+network = hparams.gen_network()
+
+
+chunks = list(zip(range(options.num_chunks), streams.inputs,
+                  streams.targets, streams.weights))
+batches_in = [b for _, b, _, _ in chunks]
+batches_out = [o for _, _, o, _ in chunks]
+weights = [w for _, _, _, w in chunks]
+num_scored = sum(np.sum(w) for w in weights)
+
+
+def evaluate(precision):
+    # a first run builds the graph of the precision
+    network.infer(batches_in[0][:, :1], ('losses',),
+                  variable_path=options.variable_path, precision=precision)
+    start = time.time()
+    results = list(network.stream(batches_in, ('losses', 'indicators'),
+                                  batches_out=batches_out,
+                                  variable_path=options.variable_path,
+                                  precision=precision))
+    elapsed = time.time() - start
+    bpc = sum(np.sum(l * w) for (l, _), w in zip(results, weights)) \
+        / num_scored / np.log(2)
+    indicators = np.concatenate([i for _, i in results], axis=2)
+    return bpc, indicators, num_scored / elapsed
+
+
+bpc, indicators, speed = evaluate('float32')
+print('%-10s BPC %.4f  %10.0f chars/s' % ('float32', bpc, speed))
+for precision in options.precisions:
+    try:
+        low_bpc, low_indicators, low_speed = evaluate(precision)
+    except Exception as e:
+        print('%-10s not supported here: %s' % (precision, e))
+        continue
+    print('%-10s BPC %.4f (%+.4f)  indicator agreement %.6f  '
+          '%10.0f chars/s (%.2fx)' % (
+              precision, low_bpc, low_bpc - bpc,
+              np.mean(indicators == low_indicators), low_speed,
+              low_speed / speed))
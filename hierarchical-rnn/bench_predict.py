@@ -0,0 +1,43 @@
+import os
+import resource
+import tempfile
+import time
+import numpy as np
+import tensorflow as tf
+from hmlstm import HMLSTMNetwork
+
+# Checks that repeated calls to predict() keep a flat latency and memory
+# footprint, i.e. that they no longer add ops to the graph on every call.
+
+NUM_CALLS = 10000
+REPORT_EVERY = 1000
+
+
+def rss_mb():
+    # current resident set size; falls back to the peak where /proc is missing
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * resource.getpagesize() / 2 ** 20
+    except IOError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10
+
+
+network = HMLSTMNetwork(output_size=27, input_size=27, num_layers=3,
+                        embed_size=64, out_hidden_size=32,
+                        hidden_state_sizes=32, task='classification')
+
+batch = np.eye(27)[np.random.randint(0, 27, size=(1, 100))]
+variable_path = os.path.join(tempfile.mkdtemp(), 'bench_predict')
+network.train([batch], [batch], variable_path=variable_path, epochs=1)
+
+print('calls\tms/call\trss_mb\tgraph_ops')
+start = time.time()
+for call in range(1, NUM_CALLS + 1):
+    network.predict(batch, variable_path=variable_path)
+    if call % REPORT_EVERY == 0:
+        elapsed = time.time() - start
+        num_ops = len(tf.get_default_graph().get_operations())
+        print('%d\t%.3f\t%.1f\t%d' % (call, 1000 * elapsed / REPORT_EVERY,
+                                      rss_mb(), num_ops))
+        start = time.time()
@@ -0,0 +1,85 @@
+import argparse
+import time
+import numpy as np
+from string import ascii_lowercase
+from hmlstm.preprocessing import load_ids, decode_ids, one_hot_encode, get_text
+
+# Compares the table based one_hot_encode / get_text with the per-character
+# loops they replaced, on a slice of text8 cut into [B, T] batches.
+
+
+def loop_one_hot_encode(text):
+    out = np.zeros((len(text), 27))
+
+    def get_index(char):
+        try:
+            return ascii_lowercase.index(char)
+        except:
+            return 26
+
+    for i, t in enumerate(text):
+        out[i, get_index(t)] = 1
+
+    return out
+
+
+def loop_get_text(encoding):
+    prediction = ''
+
+    for char in np.squeeze(encoding):
+        max_likelihood = np.where(char == np.max(char))[0][0]
+        if max_likelihood < 26:
+            prediction += ascii_lowercase[max_likelihood]
+        elif max_likelihood == 26:
+            prediction += ' '
+
+    return prediction
+
+
+def timed(fn, *args):
+    start = time.time()
+    result = fn(*args)
+    return result, time.time() - start
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--text_path', default='text8.txt')
+parser.add_argument('--num_chars', type=int, default=10 ** 7)
+parser.add_argument('--truncate_len', type=int, default=1000)
+options = parser.parse_args()
+
+# [B, T] windows covering the slice
+ids = load_ids(options.text_path, options.num_chars)
+num_windows = len(ids) // options.truncate_len
+ids = ids[:num_windows * options.truncate_len]
+texts = decode_ids(ids.reshape(num_windows, options.truncate_len))
+print('%d characters in %d windows of %d' % (len(ids), num_windows,
+                                            options.truncate_len))
+
+# encodings for the whole slice do not fit in memory at once, so both
+# implementations are timed window by window, and the vectorized ones also
+# over batches of windows
+batch_size = 100
+for name, encode, decode in (
+        ('loop', loop_one_hot_encode, loop_get_text),
+        ('vectorized', one_hot_encode, get_text)):
+    encode_time = decode_time = 0.
+    for text in texts:
+        encoding, elapsed = timed(encode, text)
+        encode_time += elapsed
+        decoded, elapsed = timed(decode, encoding)
+        decode_time += elapsed
+        assert decoded == text
+    print('%-22s encode %7.2fs  decode %7.2fs' % (name + ' (per window)',
+                                                  encode_time, decode_time))
+
+encode_time = decode_time = 0.
+for start in range(0, num_windows, batch_size):
+    batch = texts[start:start + batch_size]
+    encoding, elapsed = timed(one_hot_encode, batch)
+    encode_time += elapsed
+    decoded, elapsed = timed(get_text, encoding)
+    decode_time += elapsed
+    assert decoded == batch
+print('%-22s encode %7.2fs  decode %7.2fs' % ('vectorized (batched)',
+                                              encode_time, decode_time))
@@ -0,0 +1,68 @@
+import argparse
+import resource
+import subprocess
+import sys
+import time
+import numpy as np
+
+# Peak memory and step time of training with recompute_len, see
+# HMLSTMNetwork.train, for several lengths. Each length runs in its own
+# process, as the peak resident memory of a process only ever grows.
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--recompute_len', type=int, nargs='+',
+                    default=[0, 500, 250, 100, 50],
+                    help='0 backpropagates through the whole window')
+parser.add_argument('--num_layers', type=int, default=3)
+parser.add_argument('--hidden_size', type=int, default=1024)
+parser.add_argument('--batch_size', type=int, default=15)
+parser.add_argument('--truncate_len', type=int, default=1000)
+parser.add_argument('--steps', type=int, default=5)
+parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+options = parser.parse_args()
+
+if not options.child:
+    print('%-15s %12s %12s' % ('recompute_len', 's/step', 'peak RSS MB'))
+    for length in options.recompute_len:
+        args = [a for a in sys.argv[1:]]
+        if '--recompute_len' in args:
+            i = args.index('--recompute_len')
+            j = i + 1
+            while j < len(args) and not args[j].startswith('--'):
+                j += 1
+            del args[i:j]
+        output = subprocess.check_output(
+            [sys.executable, __file__, '--child', '--recompute_len',
+             str(length)] + args)
+        step_time, peak = output.split()[-2:]
+        print('%-15s %12.3f %12.0f' % (length or 'none', float(step_time),
+                                       float(peak)))
+    sys.exit()
+
+import tensorflow as tf
+from hmlstm import HMLSTMNetwork
+
+network = HMLSTMNetwork(output_size=27, input_size=27,
+                        num_layers=options.num_layers,
+                        embed_size=options.hidden_size * 2,
+                        out_hidden_size=options.hidden_size,
+                        hidden_state_sizes=options.hidden_size,
+                        task='classification', char_ids=True)
+network._get_graph()
+network._session = tf.Session()
+network._session.run(tf.global_variables_initializer())
+
+ids = np.random.randint(0, 27, size=(options.batch_size,
+                                     options.truncate_len + 1))
+times = []
+for step in range(options.steps + 2):
+    segments = network._segment_feed_dicts(ids[:, :-1], ids[:, 1:], None,
+                                           None, options.recompute_len[0])
+    start = time.time()
+    network._train_step(segments)
+    if step >= 2:
+        times.append(time.time() - start)
+
+# kilobytes on linux
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+print(np.median(times), peak)
@@ -0,0 +1,40 @@
+import argparse
+import numpy as np
+import tensorflow as tf
+from hmlstm import HMLSTMNetwork
+from bench_train import time_train_steps, report
+
+# Training throughput of the same global batch split across 1, 2, 4 and 8
+# data-parallel CPU towers, see HMLSTMNetwork(num_towers).
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--towers', type=int, nargs='+', default=[1, 2, 4, 8])
+parser.add_argument('--num_layers', type=int, default=3)
+parser.add_argument('--hidden_size', type=int, default=512)
+parser.add_argument('--batch_size', type=int, default=16)
+parser.add_argument('--truncate_len', type=int, default=200)
+parser.add_argument('--steps', type=int, default=10)
+parser.add_argument('--fused_cell', action='store_true')
+options = parser.parse_args()
+
+ids = np.random.randint(0, 27, size=(options.steps + 2, options.batch_size,
+                                     options.truncate_len + 1))
+batches_in, batches_out = ids[:, :, :-1], ids[:, :, 1:]
+
+baseline = None
+for num_towers in options.towers:
+    with tf.Graph().as_default():
+        network = HMLSTMNetwork(output_size=27, input_size=27,
+                                num_layers=options.num_layers,
+                                embed_size=options.hidden_size * 2,
+                                out_hidden_size=options.hidden_size,
+                                hidden_state_sizes=options.hidden_size,
+                                task='classification', char_ids=True,
+                                fused_cell=options.fused_cell,
+                                num_towers=num_towers)
+        times = time_train_steps(network, batches_in, batches_out,
+                                 options.steps)
+    report('%d towers' % num_towers, times, options.batch_size,
+           options.truncate_len)
+    baseline = baseline or np.median(times)
+    print('%20s speedup %.2fx' % ('', baseline / np.median(times)))
@@ -0,0 +1,54 @@
+import argparse
+import time
+import numpy as np
+import tensorflow as tf
+from configuration import YamlParams
+
+# Times training steps of the network configured in config.yml and reports
+# the step time and throughput in characters per second.
+
+
+def time_train_steps(network, batches_in, batches_out, num_steps, warmup=2):
+    """
+    Run warmup + num_steps training steps in a fresh session.
+
+    :return: seconds taken by each of the num_steps timed steps
+    """
+    optim, loss = network._get_graph()[:2]
+    if network._session is None:
+        network._session = tf.Session(config=network._session_config())
+        network._session.run(tf.global_variables_initializer())
+
+    times = []
+    batches = zip(batches_in, batches_out)
+    for step, (batch_in, batch_out) in enumerate(batches):
+        if step == warmup + num_steps:
+            break
+        feed_dict = network._feed_dict(batch_in, batch_out)
+        start = time.time()
+        network._session.run([optim, loss], feed_dict)
+        if step >= warmup:
+            times.append(time.time() - start)
+    return times
+
+
+def report(name, times, batch_size, truncate_len):
+    step_time = np.median(times)
+    print('%-20s %8.3f s/step  %10.0f chars/s' % (
+        name, step_time, batch_size * truncate_len / step_time))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config', default='small_nets',
+                        help='configuration in config.yml')
+    parser.add_argument('--text_path', default='text8.txt')
+    parser.add_argument('--steps', type=int, default=20)
+    options = parser.parse_args()
+
+    hparams = YamlParams('config.yml', options.config)
+    batches_in, batches_out = hparams.pre_inputs(options.text_path)
+    network = hparams.gen_network()
+
+    times = time_train_steps(network, batches_in, batches_out, options.steps)
+    report(options.config, times, hparams.batch_size, hparams.truncate_len)
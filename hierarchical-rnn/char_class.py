@@ -7,7 +7,10 @@ batches_in, batches_out = hparams.pre_inputs('text8.txt')
 network = hparams.gen_network()
 
 network.train(batches_in[:-1], batches_out[:-1], save_vars_to_disk=True, 
-              load_vars_from_disk=False, variable_path='./text8', epochs=hparams.epochs)
+              load_vars_from_disk=False, variable_path='./text8', epochs=hparams.epochs,
+              prefetch=hparams.prefetch, checkpoint_steps=hparams.checkpoint_steps,
+              checkpoint_minutes=hparams.checkpoint_minutes, resume=True,
+              bptt_len=hparams.bptt_len)
 
 predictions = network.predict(batches_in[-1], variable_path='./text8')
 boundaries = network.predict_boundaries(batches_in[-1], variable_path='./text8')
@@ -1,7 +1,8 @@
 from ruamel.yaml import YAML
 from tensorflow.contrib.training import HParams
 import argparse
-from hmlstm import HMLSTMNetwork, prepare_inputs
+from hmlstm import HMLSTMNetwork, prepare_inputs, load_ids, load_offsets, \
+    CorpusStreams, SentenceBatches, TrainingCheckpoint
 
 
 class YamlParams(HParams):
@@ -19,13 +20,35 @@ class YamlParams(HParams):
                                   num_batches=self.num_batches,
                                   truncate_len=self.truncate_len,
                                   step_size=self.step_size,
-                                  text_path=text_path)
+                                  text_path=text_path,
+                                  ids=True)
         else:
             return prepare_inputs(batch_size=1,
                                   num_batches=None,
                                   truncate_len=self.truncate_len,
                                   step_size=self.truncate_len,
-                                  text_path=text_path)
+                                  text_path=text_path,
+                                  ids=True)
+
+    def eval_streams(self, text_path):
+        if not text_path:
+            raise Exception("define text_path")
+        return CorpusStreams(load_ids(text_path),
+                             batch_size=self.eval_batch_size,
+                             truncate_len=self.truncate_len)
+
+    def sentence_batches(self, text_path, train=True, variable_path=None):
+        if not text_path:
+            raise Exception("define text_path")
+        if train:
+            # in the order of the interrupted run when there is a training
+            # checkpoint at variable_path to resume from; pass batches.seed
+            # to HMLSTMNetwork.train
+            seed = TrainingCheckpoint(variable_path).seed() if variable_path else None
+            return SentenceBatches(load_ids(text_path), load_offsets(text_path),
+                                   batch_size=self.batch_size, shuffle=True, seed=seed)
+        return SentenceBatches(load_ids(text_path), load_offsets(text_path),
+                               batch_size=self.eval_batch_size)
 
     def gen_network(self):
         return HMLSTMNetwork(output_size=self.output_size,
@@ -35,7 +58,10 @@ class YamlParams(HParams):
                              out_hidden_size=self.out_hidden_size,
                              hidden_state_sizes=self.hidden_state_sizes,
                              learning_rate=self.learning_rate,
-                             task='classification')
+                             task='classification',
+                             char_ids=True,
+                             fused_cell=self.fused_cell,
+                             num_towers=self.num_towers)
 
 
 def select_config():
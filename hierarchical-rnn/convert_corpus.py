@@ -0,0 +1,18 @@
+import argparse
+from hmlstm.preprocessing import save_corpus, load_corpus
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Convert a text corpus once into the binary id format, '
+                    'which prepare_inputs then maps into memory instead of '
+                    're-reading and normalizing the text.')
+    parser.add_argument('--text_path', action='store', dest='text_path',
+                        required=True, help='text file to convert')
+    parser.add_argument('--path', action='store', dest='path', default=None,
+                        help='output path, defaults to text_path with a .ids '
+                             'extension, where prepare_inputs looks for it')
+    options = parser.parse_args()
+
+    path = save_corpus(options.text_path, options.path)
+    print('wrote {} characters to {}'.format(len(load_corpus(path)), path))
@@ -0,0 +1,19 @@
+import argparse
+from configuration import YamlParams
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Freeze a trained network into one inference-only graph, '
+                    'which FrozenHMLSTM loads without building the network '
+                    'or restoring the checkpoint.')
+    parser.add_argument('--config', action='store', dest='config', default='default',
+                        help='configuration in config.yml of the checkpoint')
+    parser.add_argument('--variable_path', action='store', dest='variable_path',
+                        default='./text8', help='checkpoint to freeze')
+    parser.add_argument('--path', action='store', dest='path', default='./text8.pb',
+                        help='output path of the frozen graph')
+    options = parser.parse_args()
+
+    network = YamlParams('config.yml', options.config).gen_network()
+    print('wrote {}'.format(network.export(options.path, options.variable_path)))
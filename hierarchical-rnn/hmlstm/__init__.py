@@ -1,3 +1,36 @@
-from .hmlstm_network import HMLSTMNetwork
-from .viz import plot_indicators, viz_char_boundaries, save_boundaries
-from .preprocessing import prepare_inputs, get_text, convert_to_batches
+import importlib
+import sys
+import types
+from .preprocessing import prepare_inputs, get_text, convert_to_batches, \
+    load_ids, CharBatches, CorpusStreams, SentenceBatches, load_offsets, \
+    encode_ids, decode_ids, save_corpus, load_corpus, VOCAB
+from .numpy_engine import NumpyHMLSTM, convert_checkpoint
+from .prefetch import Prefetcher
+from .checkpoint import TrainingCheckpoint
+from .indicator_store import IndicatorWriter, IndicatorStore, save_indicators, \
+    checkpoint_name
+
+# names from modules that import tensorflow or matplotlib, which takes
+# seconds. They are only imported on first use, so that NumpyHMLSTM starts
+# in milliseconds and works without tensorflow installed.
+_LAZY = {
+    'HMLSTMNetwork': 'hmlstm_network',
+    'FrozenHMLSTM': 'frozen_graph',
+    'plot_indicators': 'viz',
+    'viz_char_boundaries': 'viz',
+    'save_boundaries': 'viz',
+}
+
+
+class _LazyModule(types.ModuleType):
+    def __getattr__(self, name):
+        if name not in _LAZY:
+            raise AttributeError('module %r has no attribute %r'
+                                 % (__name__, name))
+        value = getattr(importlib.import_module('.' + _LAZY[name], __name__),
+                        name)
+        setattr(self, name, value)
+        return value
+
+
+sys.modules[__name__].__class__ = _LazyModule
@@ -0,0 +1,106 @@
+import os
+import threading
+import time
+import numpy as np
+
+# written next to the variables of HMLSTMNetwork.save_variables while
+# training, and removed once training is done
+TRAINING_CHECKPOINT_EXT = '.train.npz'
+
+# key of the [epoch, batch, step] position in the checkpoint
+_POSITION = '__position__'
+# key of the seed the batches were shuffled with, if any
+_SEED = '__seed__'
+
+
+class TrainingCheckpoint(object):
+    """
+    Periodic snapshots of the training state: the values of all variables,
+    including the optimizer's slots, and the position in the data as the
+    epoch, the index of the next batch of that epoch and the global step,
+    and the seed of the shuffle of the batches if they were shuffled.
+
+    A snapshot is written to a temporary file by a background thread and
+    then renamed over the previous one, so there always is one complete
+    checkpoint on disk. Only the copy of the values out of the session
+    happens in the training loop, and at most one write is in flight.
+    """
+
+    def __init__(self, path, every_steps=None, every_minutes=None):
+        """
+        :param path: the variable_path of the training run
+        :param every_steps: save every this many training steps, if given
+        :param every_minutes: save at least every this many minutes, if
+            given
+        """
+        self.path = path + TRAINING_CHECKPOINT_EXT
+        self._every_steps = every_steps
+        self._every_seconds = every_minutes and every_minutes * 60.
+        self._last_time = time.time()
+        self._writer = None
+
+    def due(self, step):
+        """whether a snapshot should be saved after the given step"""
+        if self._every_steps and step % self._every_steps == 0:
+            return True
+        return bool(self._every_seconds
+                    and time.time() - self._last_time >= self._every_seconds)
+
+    def save(self, values, epoch, batch, step, seed=None):
+        """
+        :param values: dict of variable name to value
+        :param epoch: epoch to resume from
+        :param batch: index of the batch of that epoch to resume from
+        :param step: number of training steps taken
+        :param seed: the seed the batches were shuffled with, if any
+        """
+        self.wait()
+        self._last_time = time.time()
+        values = dict(values)
+        values[_POSITION] = np.array([epoch, batch, step], dtype=np.int64)
+        if seed is not None:
+            values[_SEED] = np.array(seed, dtype=np.int64)
+        self._writer = threading.Thread(target=self._write, args=(values,))
+        self._writer.start()
+
+    def _write(self, values):
+        # np.savez would append '.npz' to a temporary name without it
+        temporary = self.path[:-len('.npz')] + '.tmp.npz'
+        np.savez(temporary, **values)
+        os.replace(temporary, self.path)
+        print('saved training checkpoint at epoch %d, batch %d, step %d'
+              % tuple(values[_POSITION]))
+
+    def wait(self):
+        """block until the last snapshot is on disk"""
+        if self._writer is not None:
+            self._writer.join()
+            self._writer = None
+
+    def load(self):
+        """
+        :return: (values, epoch, batch, step) of the last snapshot, or None
+            if there is none
+        """
+        if not os.path.exists(self.path):
+            return None
+        with np.load(self.path) as snapshot:
+            values = dict(snapshot.items())
+        epoch, batch, step = (int(p) for p in values.pop(_POSITION))
+        values.pop(_SEED, None)
+        return values, epoch, batch, step
+
+    def seed(self):
+        """
+        :return: the seed of the shuffle saved with the last snapshot, or
+            None if there is no snapshot or the batches were not shuffled
+        """
+        if not os.path.exists(self.path):
+            return None
+        with np.load(self.path) as snapshot:
+            return int(snapshot[_SEED]) if _SEED in snapshot.files else None
+
+    def remove(self):
+        self.wait()
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,93 @@
+from .hmlstm_network import FROZEN_OUTPUTS, FROZEN_CONFIG
+import tensorflow as tf
+import numpy as np
+import json
+
+
+class FrozenHMLSTM(object):
+    def __init__(self, path):
+        """
+        Inference with a graph frozen by HMLSTMNetwork.export. Loading it
+        only parses one file into a new graph: no network is built in
+        python and no checkpoint is restored.
+
+        params:
+        ---
+        path: path of the frozen graph
+        """
+        graph_def = tf.GraphDef()
+        with open(path, 'rb') as f:
+            graph_def.ParseFromString(f.read())
+
+        # graphs exported before the devices were cleared may still place
+        # their towers on devices this machine does not have
+        for node in graph_def.node:
+            node.device = ''
+        self._graph = tf.Graph()
+        with self._graph.as_default():
+            tf.import_graph_def(graph_def, name='')
+        self._session = tf.Session(
+            graph=self._graph,
+            config=tf.ConfigProto(allow_soft_placement=True))
+
+        config = self._session.run(FROZEN_CONFIG + ':0')
+        config = json.loads(config.decode('utf-8'))
+        self._char_ids = config['char_ids']
+        self.num_layers = config['num_layers']
+        self._inputs = {name: self._graph.get_tensor_by_name(tensor)
+                        for name, tensor in config['inputs'].items()}
+        self._outputs = {name: self._graph.get_tensor_by_name(tensor)
+                         for name, tensor in config['outputs'].items()}
+
+    def infer(self, batch, outputs=('predictions', 'indicators'), state=None,
+              mask=None):
+        """
+        params:
+        ---
+        batch: as for HMLSTMNetwork.infer, ids if the network was exported
+            with char_ids
+        outputs: iterable of output names, any of 'predictions',
+            'indicators' and 'state'
+        state: as for HMLSTMNetwork.infer
+        mask: as for HMLSTMNetwork.infer
+
+        returns:
+        ---
+        a tuple with one value per requested output, with the dimensions of
+        HMLSTMNetwork.infer
+        """
+        outputs = tuple(outputs)
+        unknown = [o for o in outputs if o not in FROZEN_OUTPUTS]
+        if unknown:
+            raise ValueError('Unknown outputs %s, must be among %s'
+                             % (unknown, FROZEN_OUTPUTS))
+
+        batch = np.asarray(batch)
+        # one-hot batches are time major in the graph
+        feed_dict = {self._inputs['batch']:
+                     batch if self._char_ids else np.swapaxes(batch, 0, 1)}
+        if state is not None:
+            feed_dict[self._inputs['initial_state']] = state
+        if mask is not None:
+            feed_dict[self._inputs['mask']] = mask
+        fetched = self._session.run([self._outputs[o] for o in outputs],
+                                    feed_dict)
+
+        return tuple(np.swapaxes(value, 0, 1) if name == 'predictions'
+                     else value for name, value in zip(outputs, fetched))
+
+    def stream(self, batches, outputs=('predictions', 'indicators'),
+               state=None):
+        """
+        as HMLSTMNetwork.stream, without targets
+
+        returns:
+        ---
+        a generator of infer's results, one tuple per chunk
+        """
+        outputs = tuple(outputs)
+        fetches = outputs if 'state' in outputs else outputs + ('state',)
+        for batch in batches:
+            results = self.infer(batch, fetches, state=state)
+            state = results[fetches.index('state')]
+            yield results[:len(outputs)]
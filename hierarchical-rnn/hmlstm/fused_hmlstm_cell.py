@@ -0,0 +1,158 @@
+from .hmlstm_cell import binary_round
+from tensorflow.python.ops import rnn_cell_impl
+from tensorflow.python.ops import variable_scope as vs
+import tensorflow as tf
+
+
+class FusedHMLSTMCell(object):
+    def __init__(self, input_size, hidden_state_sizes, reuse,
+                 dtype=tf.float32):
+        """
+        All layers of the hierarchical multiscale LSTM in one step function
+        over a single flat state, computing the same thing as a
+        MultiHMLSTMCell of HMLSTMCells.
+
+        The state is [B, sum(h_l) * 2 + L], with (c, h, z) of every layer laid
+        out one after the other, as in HMLSTMNetwork.split_out_cell_states,
+        and is only ever sliced at static offsets. The kernels are the
+        variables of the HMLSTMCells, so checkpoints work with either cell,
+        but each one is cut once per run into its recurrent, top-down and
+        bottom-up parts:
+        - the input's bottom-up part of the first layer does not depend on
+          the recurrence, and is applied to all timesteps at once by
+          project_inputs
+        - the recurrent part of layer l and the top-down part of layer l - 1
+          both multiply h_l from the previous step, and are concatenated
+          into one matmul. These matmuls do not depend on each other
+        - only the bottom-up matmuls of the upper layers have to wait for the
+          layer below at the same timestep
+
+        params:
+        ---
+        input_size: integer, the size of an input at one timestep
+        hidden_state_sizes: list of integers, the size of the hidden state of
+            each layer
+        reuse: bool, whether to reuse existing variables
+        dtype: the type the recurrence runs in. The float32 variables are
+            cast to it once per run, and project_inputs casts the inputs
+        """
+        self._input_size = input_size
+        self._hidden_state_sizes = hidden_state_sizes
+        self._num_layers = len(hidden_state_sizes)
+        self._reuse = reuse
+        self._dtype = dtype
+        self._built = False
+
+    def _build(self):
+        if self._built:
+            return
+        sizes = self._hidden_state_sizes
+
+        # the same variables as HMLSTMCell's _linear under MultiHMLSTMCell,
+        # whose rows are [h; z * h_above; z_below * h_below]
+        recurrent, above, below = [], [], []
+        with vs.variable_scope('multi_hmlstm_cell', reuse=self._reuse):
+            for l, size in enumerate(sizes):
+                h_below_size = self._input_size if l == 0 else sizes[l - 1]
+                # the last layer's h_above is all zeros, see create_multicell
+                h_above_size = sizes[(l + 1) % self._num_layers]
+                with vs.variable_scope('cell_%d' % l):
+                    with vs.variable_scope('hmlstm_cell'):
+                        kernel = vs.get_variable(
+                            rnn_cell_impl._WEIGHTS_VARIABLE_NAME,
+                            [size + h_above_size + h_below_size, 4 * size + 1],
+                            dtype=tf.float32)
+                kernel = tf.cast(kernel, self._dtype)
+                recurrent.append(kernel[:size])
+                above.append(kernel[size:size + h_above_size])
+                below.append(kernel[size + h_above_size:])
+
+        # h_l @ [recurrent_l, above_(l - 1)]
+        self._h_kernels = [recurrent[0]] + [
+            tf.concat((recurrent[l], above[l - 1]), axis=1)
+            for l in range(1, self._num_layers)]
+        self._below_kernels = below
+        self._built = True
+
+    @property
+    def state_size(self):
+        return sum(self._hidden_state_sizes) * 2 + self._num_layers
+
+    def project_inputs(self, inputs):
+        '''
+        inputs: [T, B, I]
+
+        projected: [T, B, 4 * h_0 + 1], the first layer's bottom-up
+            pre-activations; z_below is always 1 for the first layer
+        '''
+        self._build()
+        num_steps, batch_size = tf.shape(inputs)[0], tf.shape(inputs)[1]
+        inputs = tf.cast(inputs, self._dtype)
+        flat = tf.matmul(tf.reshape(inputs, [-1, self._input_size]),
+                         self._below_kernels[0])
+        return tf.reshape(flat, [num_steps, batch_size, -1])
+
+    def __call__(self, state, projected_input):
+        '''
+        one timestep, to be used with tf.scan over project_inputs(inputs)
+
+        state: [B, sum(h_l) * 2 + L]
+        projected_input: [B, 4 * h_0 + 1]
+
+        new_state: [B, sum(h_l) * 2 + L]
+        '''
+        self._build()
+        sizes = self._hidden_state_sizes
+
+        cs, hs, zs = [], [], []
+        offset = 0
+        for size in sizes:
+            cs.append(state[:, offset:offset + size])
+            hs.append(state[:, offset + size:offset + 2 * size])
+            zs.append(state[:, offset + 2 * size:offset + 2 * size + 1])
+            offset += 2 * size + 1
+
+        # everything from the previous timestep: [B, 4 * h_l + 1] recurrent
+        # pre-activations, and top-down ones for layer l - 1
+        recurrent, above = [], []
+        for l, size in enumerate(sizes):
+            product = tf.matmul(hs[l], self._h_kernels[l])
+            recurrent.append(product[:, :4 * size + 1])
+            if l > 0:
+                above.append(product[:, 4 * size + 1:])
+        above.append(None)      # the last layer has nothing above
+
+        new_states = []
+        z_below = None
+        for l, size in enumerate(sizes):
+            c, h, z = cs[l], hs[l], zs[l]
+
+            pre = recurrent[l]
+            if above[l] is not None:
+                pre += z * above[l]
+            if l == 0:
+                pre += projected_input
+            else:
+                pre += z_below * tf.matmul(new_states[-1][1],
+                                           self._below_kernels[l])
+
+            i = tf.sigmoid(pre[:, :size])
+            g = tf.tanh(pre[:, size:2 * size])
+            f = tf.sigmoid(pre[:, 2 * size:3 * size])
+            o = tf.sigmoid(pre[:, 3 * size:4 * size])
+            z_tilde = pre[:, 4 * size:]
+
+            # flush if z == 1, copy if z == 0 and z_below == 0, update
+            # otherwise; as exact 0/1 masks rather than both branches of a
+            # tf.where, with no gradient through the choice, like tf.where
+            zb = tf.ones_like(z) if l == 0 else z_below
+            copy = tf.stop_gradient((1. - z) * (1. - zb))
+            update = tf.stop_gradient((1. - z) * zb)
+            new_c = copy * c + (1. - copy) * (i * g + update * f * c)
+            new_h = copy * h + (1. - copy) * o * tf.tanh(new_c)
+            new_z = binary_round(tf.sigmoid(z_tilde))
+
+            new_states.append((new_c, new_h, new_z))
+            z_below = new_z
+
+        return tf.concat([t for s in new_states for t in s], axis=1)
@@ -135,12 +135,16 @@ class HMLSTMCell(rnn_cell_impl.RNNCell):
         slope_multiplier = 1  # NOTE: Change this for some tasks
         sigmoided = tf.sigmoid(z_tilde * slope_multiplier)
 
-        # replace gradient calculation - use straight-through estimator
-        # see: https://r2rt.com/binary-stochastic-neurons-in-tensorflow.html
-        graph = tf.get_default_graph()
-        with ops.name_scope('BinaryRound') as name:
-            with graph.gradient_override_map({'Round': 'Identity'}):
-                new_z = tf.round(sigmoided, name=name)
+        new_z = binary_round(sigmoided)
 
         return tf.squeeze(new_z, axis=1)
 
+
+def binary_round(x):
+    # replace gradient calculation - use straight-through estimator
+    # see: https://r2rt.com/binary-stochastic-neurons-in-tensorflow.html
+    graph = tf.get_default_graph()
+    with ops.name_scope('BinaryRound') as name:
+        with graph.gradient_override_map({'Round': 'Identity'}):
+            return tf.round(x, name=name)
+
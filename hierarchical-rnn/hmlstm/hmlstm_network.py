@@ -1,10 +1,17 @@
 from .hmlstm_cell import HMLSTMCell, HMLSTMState
 from .multi_hmlstm_cell import MultiHMLSTMCell
+from .fused_hmlstm_cell import FusedHMLSTMCell
+from .numpy_engine import NUMPY_EXT
+from .prefetch import Prefetcher
+from .checkpoint import TrainingCheckpoint
 from tensorflow.python.ops import array_ops
 from tensorflow.python.ops import variable_scope as vs
 import tensorflow as tf
 import numpy as np
+import itertools
+import json
 import sys
+import time
 
 
 class Unbuffered(object):
@@ -21,6 +28,15 @@ class Unbuffered(object):
 
 sys.stdout = Unbuffered(sys.stdout)
 
+# names of the outputs HMLSTMNetwork.infer can fetch
+INFER_OUTPUTS = ('predictions', 'loss', 'losses', 'indicators', 'gradients',
+                 'saliency', 'state')
+
+# the outputs kept by HMLSTMNetwork.export
+FROZEN_OUTPUTS = ('predictions', 'indicators', 'state')
+# the JSON constant of a frozen graph that tells how to feed and read it
+FROZEN_CONFIG = 'export/config'
+
 
 class HMLSTMNetwork(object):
     def __init__(self,
@@ -31,7 +47,10 @@ class HMLSTMNetwork(object):
                  out_hidden_size=100,
                  embed_size=100,
                  learning_rate=1e-4,
-                 task='regression'):
+                 task='regression',
+                 char_ids=False,
+                 fused_cell=False,
+                 num_towers=1):
         """
         HMLSTMNetwork is a class representing hierarchical multiscale
         long short-term memory network.
@@ -50,6 +69,19 @@ class HMLSTMNetwork(object):
             output network.
         embed_size: integer, the size of the embedding in the output network.
         task: string, one of 'regression' and 'classification'.
+        char_ids: bool, whether batches are fed as integer class ids of
+            shape [batch_size, num_timesteps] instead of one-hot encodings.
+            The ids are then made time major and one-hot encoded in the
+            graph, and the loss is a sparse softmax cross entropy. Only for
+            task 'classification'.
+        fused_cell: bool, whether to run the recurrence with FusedHMLSTMCell
+            rather than a MultiHMLSTMCell of HMLSTMCells. Both compute the
+            same thing with the same variables.
+        num_towers: integer, number of towers that each run an equal share
+            of the sequences of a batch on their own CPU device, in
+            parallel. Their gradients are summed into one update, the same
+            as with one tower. Batches of any size are split as evenly as
+            possible, the shares differing by at most one sequence.
         """
 
         self._out_hidden_size = out_hidden_size
@@ -58,8 +90,16 @@ class HMLSTMNetwork(object):
         self._input_size = input_size
         self._session = None
         self._graph = None
+        self._fetches = None
+        self._recompute = None
+        self._precision_fetches = {}
+        # (output tensor names, config op) of export, built once
+        self._export_ops = None
         self._task = task
         self._output_size = output_size
+        self._char_ids = char_ids
+        self._fused_cell = fused_cell
+        self._num_towers = num_towers
 
         if type(hidden_state_sizes) is list \
             and len(hidden_state_sizes) != num_layers:
@@ -76,12 +116,32 @@ class HMLSTMNetwork(object):
         elif task == 'regression':
             self._loss_function = lambda logits, labels: tf.square((logits - labels))
 
-        batch_in_shape = (None, None, self._input_size)
-        batch_out_shape = (None, None, self._output_size)
-        self.batch_in = tf.placeholder(
-            tf.float32, shape=batch_in_shape, name='batch_in')
-        self.batch_out = tf.placeholder(
-            tf.float32, shape=batch_out_shape, name='batch_out')
+        if char_ids:
+            if task != 'classification':
+                raise ValueError('char_ids is only supported for the'
+                                 + ' classification task.')
+            # [B, T] ids, made time major and one-hot encoded in the graph
+            self.ids_in = tf.placeholder(
+                tf.int32, shape=(None, None), name='ids_in')
+            self.ids_out = tf.placeholder(
+                tf.int32, shape=(None, None), name='ids_out')
+            self.batch_in = tf.one_hot(
+                tf.transpose(self.ids_in), self._input_size, name='batch_in')
+            self.batch_out = None
+            # [T, B, 1] int32 class ids
+            self._targets = tf.expand_dims(tf.transpose(self.ids_out), -1)
+            self._loss_function = \
+                lambda logits, labels: \
+                tf.nn.sparse_softmax_cross_entropy_with_logits(
+                    logits=logits, labels=tf.squeeze(labels, axis=[1]))
+        else:
+            batch_in_shape = (None, None, self._input_size)
+            batch_out_shape = (None, None, self._output_size)
+            self.batch_in = tf.placeholder(
+                tf.float32, shape=batch_in_shape, name='batch_in')
+            self.batch_out = tf.placeholder(
+                tf.float32, shape=batch_out_shape, name='batch_out')
+            self._targets = self.batch_out
 
         self._optimizer = tf.train.AdamOptimizer(learning_rate=learning_rate)
         self._initialize_output_variables()
@@ -117,7 +177,7 @@ class HMLSTMNetwork(object):
 
     def load_variables(self, path='./hmlstm_ckpt'):
         if self._session is None:
-            self._session = tf.Session()
+            self._session = tf.Session(config=self._session_config())
 
             saver = tf.train.Saver()
             print('loading variables...')
@@ -128,6 +188,71 @@ class HMLSTMNetwork(object):
         print('saving variables...')
         saver.save(self._session, path)
 
+        # the trainable variables again as plain arrays, for NumpyHMLSTM
+        variables = tf.trainable_variables()
+        values = self._session.run(variables)
+        np.savez(path + NUMPY_EXT,
+                 **{v.op.name: value for v, value in zip(variables, values)})
+
+    def export(self, path, variable_path='./hmlstm_ckpt'):
+        """
+        Freeze the inference part of the graph, with the variables as
+        constants, into one file that FrozenHMLSTM serves without building
+        the network or restoring a checkpoint. There are no optimizer ops
+        and no target placeholder in it, and no device placement, so that
+        a graph trained with towers loads on any machine.
+
+        params:
+        ---
+        path: path of the frozen graph
+        variable_path: as for infer
+
+        returns:
+        ---
+        path
+        """
+        self._get_graph()
+        self._load_vars(variable_path)
+
+        if self._export_ops is None:
+            self._export_ops = self._build_export_ops()
+        outputs, config = self._export_ops
+
+        node_names = [n.split(':')[0] for n in outputs.values()]
+        frozen = tf.graph_util.convert_variables_to_constants(
+            self._session, self._session.graph.as_graph_def(),
+            node_names + [config.op.name])
+        # e.g. the /cpu:i of the towers, which need not exist where the
+        # graph is loaded
+        for node in frozen.node:
+            node.device = ''
+        with open(path, 'wb') as f:
+            f.write(frozen.SerializeToString())
+        return path
+
+    def _build_export_ops(self):
+        '''
+        output tensor names: dict of FROZEN_OUTPUTS to tensor names
+        config: the FROZEN_CONFIG constant
+        '''
+        batch_in = self.ids_in if self._char_ids else self.batch_in
+        # the scope by its full name, so that it is 'export' whatever the
+        # current scope, rather than made unique as 'export_1'
+        with tf.name_scope(FROZEN_CONFIG.split('/')[0] + '/'):
+            outputs = {name: tf.identity(self._fetches[name], name=name).name
+                       for name in FROZEN_OUTPUTS}
+            # how to feed and read the graph, see FrozenHMLSTM
+            config = tf.constant(json.dumps({
+                'char_ids': self._char_ids,
+                'input_size': self._input_size,
+                'num_layers': self._num_layers,
+                'inputs': {'batch': batch_in.name,
+                           'initial_state': self._initial_state.name,
+                           'mask': self.mask.name},
+                'outputs': outputs,
+            }), name=FROZEN_CONFIG.split('/')[1])
+        return outputs, config
+
     def gate_input(self, hidden_states):
         '''
         gate the incoming hidden states
@@ -136,10 +261,14 @@ class HMLSTMNetwork(object):
         gated_input: [B, sum(h_l)]
         '''
         with vs.variable_scope('gates_vars', reuse=True):
-            gates = []  # [[B, 1] for l in range(L)]
-            for l in range(self._num_layers):
-                weights = vs.get_variable('gate_%d' % l, dtype=tf.float32)
-                gates.append(tf.sigmoid(tf.matmul(hidden_states, weights)))
+            # all layers' gates in one matmul
+            weights = tf.concat(
+                [vs.get_variable('gate_%d' % l, dtype=tf.float32)
+                 for l in range(self._num_layers)], axis=1)  # [sum(h_l), L]
+            weights = tf.cast(weights, hidden_states.dtype)
+            gates = tf.sigmoid(tf.matmul(hidden_states, weights))  # [B, L]
+            gates = array_ops.split(
+                value=gates, num_or_size_splits=self._num_layers, axis=1)
 
             split = array_ops.split(
                 value=hidden_states,
@@ -161,6 +290,7 @@ class HMLSTMNetwork(object):
         '''
         with vs.variable_scope('embedding_vars', reuse=True):
             embed_weights = vs.get_variable('embed_weights', dtype=tf.float32)
+            embed_weights = tf.cast(embed_weights, gated_input.dtype)
 
             prod = tf.matmul(gated_input, embed_weights)
             embedding = tf.nn.relu(prod)
@@ -170,7 +300,7 @@ class HMLSTMNetwork(object):
     def output_module(self, embedding, outcome):
         '''
         embedding: [B, E]
-        outcome: [B, output_size]
+        outcome: [B, output_size], or [B, 1] class ids with char_ids
 
         loss: [B, output_size] or [B, 1]
         prediction: [B, output_size]
@@ -182,6 +312,9 @@ class HMLSTMNetwork(object):
             w1 = vs.get_variable('w1')
             w2 = vs.get_variable('w2')
             w3 = vs.get_variable('w3')
+            # in the type of the embedding, see HMLSTMNetwork.infer's precision
+            b1, b2, b3, w1, w2, w3 = [tf.cast(v, embedding.dtype)
+                                      for v in (b1, b2, b3, w1, w2, w3)]
 
             # feed forward network
             # first layer
@@ -193,6 +326,8 @@ class HMLSTMNetwork(object):
             # the loss function used below
             # softmax_cross_entropy_with_logits
             prediction = tf.add(tf.matmul(l2, w3), b3, name='prediction')
+            # the softmax and the loss are always float32
+            prediction = tf.cast(prediction, tf.float32)
 
             loss_args = {'logits': prediction, 'labels': outcome}
             loss = self._loss_function(**loss_args)
@@ -266,6 +401,116 @@ class HMLSTMNetwork(object):
 
     def network(self, reuse):
         batch_size = tf.shape(self.batch_in)[1]
+        # [B, T], 1 for timesteps of the sequences and 0 for padding after
+        # their end, which is left out of the loss and the indicators
+        self.mask = tf.placeholder_with_default(
+            tf.ones([batch_size, tf.shape(self.batch_in)[0]]),
+            shape=(None, None), name='mask')
+        # denote 'elem_len' as 'H'
+        elem_len = (sum(self._hidden_state_sizes) * 2) + self._num_layers
+        # [B, H], zeros unless the final state of a previous run is fed in
+        self._initial_state = tf.placeholder_with_default(
+            tf.zeros([batch_size, elem_len]), shape=(None, elem_len),
+            name='initial_state')
+
+        # each tower runs batch_size / num_towers of the sequences, rounded
+        # up for the last batch_size % num_towers towers, so that any batch
+        # size splits, e.g. the last, partial batch of an epoch
+        tower_sizes = tf.stack([(batch_size + i) // self._num_towers
+                                for i in range(self._num_towers)])
+
+        def split(value, axis):
+            if self._num_towers == 1:
+                return [value]
+            return tf.split(value, tower_sizes, axis=axis,
+                            num=self._num_towers)
+
+        towers = []
+        for i, tower_in in enumerate(zip(
+                split(self.batch_in, 1), split(self._targets, 1),
+                split(self.mask, 0), split(self._initial_state, 0))):
+            with tf.device(self._tower_device(i)):
+                with tf.name_scope('tower_%d' % i):
+                    towers.append(
+                        self._tower(*(tower_in + (elem_len, reuse or i > 0))))
+        indicators, predictions, losses, final_state = [
+            t[0] if len(t) == 1 else tf.concat(t, axis=axis)
+            for t, axis in zip(zip(*towers), (0, 1, 1, 0))]
+
+        # scalar, mean over the timesteps that are not padding
+        num_scored = tf.maximum(tf.reduce_sum(self.mask), 1.)
+        loss = tf.reduce_sum(losses) / num_scored
+        if self._num_towers == 1:
+            train = self._optimizer.minimize(loss)
+        else:
+            # the gradients of every tower's share of the loss, summed on
+            # the host; the same gradients as for all sequences on one device
+            tower_gradients = []
+            for i, tower in enumerate(towers):
+                with tf.device(self._tower_device(i)):
+                    tower_gradients.append(self._optimizer.compute_gradients(
+                        tf.reduce_sum(tower[2]) / num_scored))
+            gradients = [
+                (tf.add_n([g[j][0] for g in tower_gradients]), v)
+                for j, (grad, v) in enumerate(tower_gradients[0])
+                if grad is not None]
+            train = self._optimizer.apply_gradients(gradients)
+
+        return train, loss, indicators, predictions, losses, final_state
+
+    def _tower(self, batch_in, targets, mask, initial, elem_len, reuse,
+               dtype=tf.float32):
+        '''
+        the recurrence and the output module run in dtype, which needs the
+        fused cell unless it is float32
+
+        batch_in: [T, B, I]
+        targets: [T, B, O], or [T, B, 1] with char_ids
+        mask: [B, T]
+        initial: [B, H]
+
+        indicators: [B, L, T]
+        predictions: [T, B, O]
+        losses: [T, B]
+        final_state: [B, H]
+        '''
+        batch_size = tf.shape(batch_in)[1]
+        if self._fused_cell or dtype != tf.float32:
+            cell = FusedHMLSTMCell(self._input_size, self._hidden_state_sizes,
+                                   reuse, dtype)
+            projected = cell.project_inputs(batch_in)           # [T, B, 4h_0+1]
+            states = tf.scan(cell, projected,
+                             tf.cast(initial, dtype))           # [T, B, H]
+        else:
+            states = self._scan_multicell(batch_in, batch_size, initial,
+                                          reuse)
+
+        outputs = self._output_graph(states, targets, mask, batch_size,
+                                     elem_len)
+        final_state = tf.cast(states[-1], tf.float32)           # [B, H]
+
+        return outputs + (final_state,)
+
+    def _tower_device(self, index):
+        if self._num_towers == 1:
+            return None
+        return '/cpu:%d' % index
+
+    def _session_config(self):
+        '''
+        one CPU device per tower, see network
+        '''
+        if self._num_towers == 1:
+            return None
+        return tf.ConfigProto(device_count={'CPU': self._num_towers})
+
+    def _scan_multicell(self, batch_in, batch_size, initial, reuse):
+        '''
+        batch_in: [T, B, I]
+        initial: [B, H]
+
+        states: [T, B, H]
+        '''
         hmlstm = self.create_multicell(batch_size, reuse)
 
         def scan_rnn(accum, elem):
@@ -282,41 +527,48 @@ class HMLSTMNetwork(object):
             # a list of [B, h_l + h_l + 1]
             concated_states = [array_ops.concat(tuple(s), axis=1) for s in state]
             return array_ops.concat(concated_states, axis=1)    # [B, H]
-        # denote 'elem_len' as 'H'
-        elem_len = (sum(self._hidden_state_sizes) * 2) + self._num_layers
-        initial = tf.zeros([batch_size, elem_len])              # [B, H]
 
-        states = tf.scan(scan_rnn, self.batch_in, initial)      # [T, B, H]
+        return tf.scan(scan_rnn, batch_in, initial)             # [T, B, H]
 
-        def map_indicators(elem):
-            state = self.split_out_cell_states(elem)
-            return tf.concat([l.z for l in state], axis=1)
+    def _output_graph(self, states, targets, mask, batch_size, elem_len):
+        '''
+        states: [T, B, H]
+        targets: [T, B, O], or [T, B, 1] with char_ids
+        mask: [B, T]
 
-        raw_indicators = tf.map_fn(map_indicators, states)      # [T, B, L]
+        indicators: [B, L, T]
+        predictions: [T, B, O]
+        losses: [T, B]
+        '''
+        # the output module does not feed back into the recurrence, so it
+        # runs on all timesteps at once, with [T * B, _] matrices
+        num_steps = tf.shape(states)[0]
+        flat_states = tf.reshape(states, [-1, elem_len])        # [T * B, H]
+        cell_states = self.split_out_cell_states(flat_states)
+
+        raw_indicators = tf.reshape(
+            tf.concat([s.z for s in cell_states], axis=1),
+            [num_steps, batch_size, self._num_layers])          # [T, B, L]
         indicators = tf.transpose(raw_indicators, [1, 2, 0])    # [B, L, T]
-        to_map = tf.concat((states, self.batch_out), axis=2)    # [T, B, H + O]
-
-        def map_output(elem):
-            splits = tf.constant([elem_len, self._output_size])
-            cell_states, outcome = array_ops.split(value=elem,
-                                                   num_or_size_splits=splits,
-                                                   axis=1)
-
-            hs = [s.h for s in self.split_out_cell_states(cell_states)]
-            gated = self.gate_input(tf.concat(hs, axis=1))      # [B, sum(h_l)]
-            embeded = self.embed_input(gated)                   # [B, E]
-            loss, prediction = self.output_module(embeded, outcome)
-            # [B, output_size * 2] or [B, 1 + output_size]
-            return tf.concat((loss, prediction), axis=1)
-
-        mapped = tf.map_fn(map_output, to_map)                  # [T, B, _]
-
-        # mapped has diffenent shape for task 'regression' and 'classification'
-        loss = tf.reduce_mean(mapped[:, :, :-self._output_size])  # scalar
-        predictions = mapped[:, :, -self._output_size:]
-        train = self._optimizer.minimize(loss)
-
-        return train, loss, indicators, predictions
+        indicators = tf.cast(indicators, tf.float32) * tf.expand_dims(mask, 1)
+
+        hs = tf.concat([s.h for s in cell_states], axis=1)      # [T * B, sum(h_l)]
+        gated = self.gate_input(hs)                             # [T * B, sum(h_l)]
+        embeded = self.embed_input(gated)                       # [T * B, E]
+        # [T * B, O], or [T * B, 1] with char_ids
+        target_size = targets.get_shape()[-1].value
+        outcome = tf.reshape(targets, [-1, target_size])
+        # loss has diffenent shape for task 'regression' and 'classification'
+        flat_loss, flat_predictions = self.output_module(embeded, outcome)
+
+        # [T, B], loss of every timestep, 0 for padding
+        losses = tf.reshape(tf.reduce_mean(flat_loss, axis=1),
+                            [num_steps, batch_size]) * tf.transpose(mask)
+        predictions = tf.reshape(
+            flat_predictions,
+            [num_steps, batch_size, self._output_size])         # [T, B, O]
+
+        return indicators, predictions, losses
 
     def train(self,
               batches_in,
@@ -324,48 +576,398 @@ class HMLSTMNetwork(object):
               variable_path='./hmlstm_ckpt',
               load_vars_from_disk=False,
               save_vars_to_disk=False,
-              epochs=3):
+              epochs=3,
+              masks=None,
+              prefetch=2,
+              checkpoint_steps=None,
+              checkpoint_minutes=None,
+              resume=False,
+              bptt_len=None,
+              recompute_len=None,
+              seed=None):
         """
         Train the network.
 
         params:
         ---
-        batches_in: a 4 dimensional numpy array. The dimensions should be
+        batches_in: a 4 dimensional numpy array, or any sequence of batches.
+            The dimensions should be
             [num_batches, batch_size, num_timesteps, input_size]
+            (or [num_batches, batch_size, num_timesteps] with char_ids)
             These represent the input at each time step for each batch.
-        batches_out: a 4 dimensional numpy array. The dimensions should be
+        batches_out: a 4 dimensional numpy array, or any sequence of batches.
+            The dimensions should be
             [num_batches, batch_size, num_timesteps, output_size]
+            (or [num_batches, batch_size, num_timesteps] with char_ids)
             These represent the output at each time step for each batch.
         variable_path: the path to which variable values will be saved and/or
             loaded
         load_vars_from_disk: bool, whether to load variables prior to training
         load_vars_from_disk: bool, whether to save variables after training
         epochs: integer, number of epochs
+        masks: optional sequence of [batch_size, num_timesteps] masks, one per
+            batch, with 0 for the padding of sequences shorter than the batch
+        prefetch: integer, number of batches a background thread prepares
+            ahead of the training step, or 0 to prepare them in between
+            steps. The time spent waiting for input is reported after every
+            epoch.
+        checkpoint_steps: integer, save a training checkpoint every this many
+            steps, see TrainingCheckpoint
+        checkpoint_minutes: number, save a training checkpoint at least every
+            this many minutes
+        resume: bool, whether to continue from the training checkpoint at
+            variable_path, if there is one, with the batch after the last
+            one it had trained on. The batches sequences should be the same
+            as for the interrupted run; the ones already trained on are
+            sliced off rather than read again. The checkpoint is removed
+            once training is done.
+        bptt_len: integer, if given, backpropagate through segments of at
+            most this many timesteps of each batch, one update per segment,
+            with the final state of a segment carried into the next one
+            without gradients. Memory then grows with bptt_len rather than
+            with the length of the batch.
+        recompute_len: integer, if given, only keep the state every this
+            many timesteps during the forward pass, and compute the
+            activations in between again for the backward pass. Trades
+            about one more forward pass for activation memory that grows
+            with recompute_len, with the same updates. Applies within the
+            bptt_len segments.
+        seed: the seed the batches were shuffled with, e.g.
+            SentenceBatches.seed, saved with the training checkpoints.
+            Resuming with batches shuffled with another seed raises a
+            ValueError, as the batches skipped would not be the ones
+            trained on.
         """
 
-        optim, loss, _, _ = self._get_graph()
+        optim, loss = self._get_graph()[:2]
 
         if not load_vars_from_disk:
             if self._session is None:
 
-                self._session = tf.Session()
+                self._session = tf.Session(config=self._session_config())
                 init = tf.global_variables_initializer()
                 self._session.run(init)
         else:
             self.load_variables(variable_path)
 
-        for epoch in range(epochs):
+        checkpoint = TrainingCheckpoint(variable_path, checkpoint_steps,
+                                        checkpoint_minutes)
+        variables = tf.global_variables()
+        start_epoch = start_batch = step = 0
+        restored = checkpoint.load() if resume else None
+        if restored is not None:
+            if checkpoint.seed() != seed:
+                raise ValueError(
+                    'The training checkpoint at %s was saved with batches '
+                    'shuffled with seed %s, not %s; pass them in the same '
+                    'order to resume, see SentenceBatches'
+                    % (variable_path, checkpoint.seed(), seed))
+            values, start_epoch, start_batch, step = restored
+            for v in variables:
+                v.load(values[v.op.name], self._session)
+            print('resuming at epoch %d, batch %d' % (start_epoch, start_batch))
+
+        for epoch in range(start_epoch, epochs):
             print('Epoch %d' % epoch)
-            for batch_in, batch_out in zip(batches_in, batches_out):
-                ops = [optim, loss]
-                feed_dict = {
-                    self.batch_in: np.swapaxes(batch_in, 0, 1),
-                    self.batch_out: np.swapaxes(batch_out, 0, 1),
-                }
-                _, _loss = self._session.run(ops, feed_dict)
+            skip = start_batch if epoch == start_epoch else 0
+            epoch_masks = itertools.repeat(None) if masks is None \
+                else masks[skip:]
+            feed_dicts = Prefetcher(
+                (self._segment_feed_dicts(batch_in, batch_out, mask, bptt_len,
+                                          recompute_len)
+                 for batch_in, batch_out, mask
+                 in zip(batches_in[skip:], batches_out[skip:], epoch_masks)),
+                prefetch)
+            start = time.time()
+            for batch, segments in enumerate(feed_dicts, skip + 1):
+                _loss = self._train_step(segments)
                 print('loss:', _loss)
+                step += 1
+                if checkpoint.due(step):
+                    values = self._session.run(variables)
+                    checkpoint.save(
+                        {v.op.name: x for v, x in zip(variables, values)},
+                        epoch, batch, step, seed)
+            elapsed = time.time() - start
+            print('waited on input for %.1fs of %.1fs (%.1f%%)' % (
+                feed_dicts.wait_time, elapsed,
+                100. * feed_dicts.wait_time / max(elapsed, 1e-9)))
 
         self.save_variables(variable_path)
+        checkpoint.remove()
+
+    def _segment_feed_dicts(self, batch_in, batch_out, mask, bptt_len,
+                            recompute_len=None):
+        '''
+        feed dicts of the consecutive segments of bptt_len timesteps of a
+        batch, or of the whole batch if bptt_len is None, each as a list of
+        feed dicts of its pieces of recompute_len timesteps, or of one piece
+        if recompute_len is None
+        '''
+        def cut(start, stop, length):
+            if not length:
+                return [(start, stop)]
+            return [(t, min(t + length, stop))
+                    for t in range(start, stop, length)]
+
+        # batches may come as nested lists, as np.swapaxes in _feed_dict takes
+        batch_in, batch_out = np.asarray(batch_in), np.asarray(batch_out)
+        if mask is not None:
+            mask = np.asarray(mask)
+        num_steps = batch_in.shape[1]
+        return [
+            [self._feed_dict(batch_in[:, t:u], batch_out[:, t:u],
+                             None if mask is None else mask[:, t:u])
+             for t, u in cut(start, stop, recompute_len)]
+            for start, stop in cut(0, num_steps, bptt_len)]
+
+    def _train_step(self, segments):
+        '''
+        segments: consecutive segments of the same batch, see
+            _segment_feed_dicts
+
+        loss: mean loss of the segments
+        '''
+        optim, loss = self._get_graph()[:2]
+        if len(segments) == 1 and len(segments[0]) == 1:
+            return self._session.run([optim, loss], segments[0][0])[1]
+
+        losses = []
+        state = None
+        for pieces in segments:
+            if len(pieces) > 1:
+                segment_loss, state = self._recompute_step(pieces, state)
+            else:
+                feed_dict = pieces[0]
+                if state is not None:
+                    feed_dict[self._initial_state] = state
+                _, segment_loss, state = self._session.run(
+                    [optim, loss, self._fetches['state']], feed_dict)
+            losses.append(segment_loss)
+        return np.mean(losses)
+
+    def _recompute_step(self, pieces, state=None):
+        '''
+        One update over consecutive pieces of a segment that only keeps the
+        states between pieces: a forward pass over the pieces, then a
+        backward pass in reverse order that runs each piece forward again
+        from its initial state and backpropagates into it, with the gradient
+        of the loss of the later pieces with respect to its final state. The
+        gradients of all pieces add up in accumulators and are applied
+        once, so the update is the same as for the segment in one piece.
+
+        pieces: feed dicts, see _segment_feed_dicts
+        state: [B, H] initial state of the first piece, or None for zeros
+
+        loss: mean loss of the segment
+        final_state: [B, H]
+        '''
+        ops = self._recompute_ops()
+
+        # forward, keeping only the initial state of each piece
+        states = [state]
+        loss_sum = num_scored = 0.
+        for feed_dict in pieces:
+            if states[-1] is not None:
+                feed_dict[self._initial_state] = states[-1]
+            piece_loss, piece_scored, final_state = self._session.run(
+                [ops['loss_sum'], ops['num_scored'], self._fetches['state']],
+                feed_dict)
+            loss_sum += piece_loss
+            num_scored += piece_scored
+            states.append(final_state)
+
+        # backward
+        self._session.run(ops['reset'])
+        state_grad = np.zeros_like(states[-1])
+        for feed_dict in reversed(pieces):
+            feed_dict[self._state_grad] = state_grad
+            _, state_grad = self._session.run(
+                [ops['accumulate'], ops['initial_state_grad']], feed_dict)
+
+        self._session.run(ops['apply'],
+                          {ops['scale']: 1. / max(num_scored, 1.)})
+        return loss_sum / max(num_scored, 1.), states[-1]
+
+    def _recompute_ops(self):
+        '''
+        ops of _recompute_step, built on first use
+        '''
+        if self._recompute is not None:
+            return self._recompute
+
+        losses, final_state = self._get_graph()[4:]
+        # the gradient of the loss of the timesteps after the final state
+        self._state_grad = tf.placeholder(
+            tf.float32, shape=final_state.get_shape(), name='state_grad')
+        loss_sum = tf.reduce_sum(losses)
+        objective = loss_sum + tf.reduce_sum(final_state * self._state_grad)
+
+        variables = tf.trainable_variables()
+        gradients = tf.gradients(objective, variables + [self._initial_state])
+        pairs = [(g, v) for g, v in zip(gradients[:-1], variables)
+                 if g is not None]
+        # not saved with the model; they only live for one update
+        accumulators = [
+            tf.Variable(tf.zeros(v.get_shape()), trainable=False,
+                        collections=[tf.GraphKeys.LOCAL_VARIABLES],
+                        name=v.op.name.replace('/', '_') + '_accumulator')
+            for _, v in pairs]
+        scale = tf.placeholder(tf.float32, shape=(), name='gradient_scale')
+
+        self._recompute = {
+            'loss_sum': loss_sum,
+            'num_scored': tf.reduce_sum(self.mask),
+            'initial_state_grad': gradients[-1],
+            'accumulate': tf.group(*[a.assign_add(g) for a, (g, _)
+                                     in zip(accumulators, pairs)]),
+            'reset': tf.variables_initializer(accumulators),
+            # the optimizer's slots are the ones of the train op
+            'apply': self._optimizer.apply_gradients(
+                [(a * scale, v) for a, (_, v) in zip(accumulators, pairs)]),
+            'scale': scale,
+        }
+        return self._recompute
+
+    def infer(self, batch, outputs=('predictions', 'loss', 'indicators'),
+              batch_out=None, variable_path='./hmlstm_ckpt', state=None,
+              mask=None, precision='float32'):
+        """
+        Run the network forward once over a batch and fetch every requested
+        output from that single pass.
+
+        params:
+        ---
+        batch: batch to run the network on. should have dimensions
+            [batch_size, num_timesteps, input_size], or
+            [batch_size, num_timesteps] with char_ids
+        outputs: iterable of output names, any of 'predictions', 'loss',
+            'losses', 'indicators', 'gradients', 'saliency' and 'state'. The
+            losses are the loss of every timestep. The gradients
+            are those of the predictions at the last timestep with respect to
+            the input, and the saliency is their absolute value summed over
+            the input dimension. The state is the (c, h, z) of every layer
+            after the last timestep.
+        batch_out: targets for the loss, with dimensions
+            [batch_size, num_timesteps, output_size]. If None, the targets
+            are the inputs shifted by one timestep, and the last timestep,
+            which has no target, is left out of the loss and has a loss of
+            0 in the losses, like padding.
+        variable_path: string. If there is no active session in the network
+            object (i.e. it has not yet been used to train or predict, or the
+            tensorflow session has been manually closed), variables will be
+            loaded from the provided path. Otherwise variables already present
+            in the session will be used.
+        state: the 'state' output of a previous call, to continue the
+            sequences of that batch rather than to start from zeros.
+        mask: [batch_size, num_timesteps], 0 for padding after the end of
+            shorter sequences. Padding has zero losses and indicators and
+            does not count towards the mean loss. Defaults to all ones.
+        precision: the type to run the recurrence and the output module in,
+            'float32', or 'float16' or 'bfloat16' for faster, approximate
+            inference with the same variables, see _get_precision_fetches.
+            Gradients and saliency are only available in float32.
+
+        returns:
+        ---
+        a tuple with one value per requested output, in the requested order:
+        predictions with dimensions [batch_size, num_timesteps, output_size],
+        the mean loss as a float, losses with dimensions
+        [batch_size, num_timesteps], indicators with dimensions
+        [batch_size, num_layers, num_timesteps], gradients with dimensions
+        [batch_size, num_timesteps, input_size], saliency with dimensions
+        [batch_size, num_timesteps] and the state with dimensions
+        [batch_size, sum(hidden_state_sizes) * 2 + num_layers]
+        """
+
+        outputs = tuple(outputs)
+        unknown = [o for o in outputs if o not in INFER_OUTPUTS]
+        if unknown:
+            raise ValueError('Unknown outputs %s, must be among %s'
+                             % (unknown, INFER_OUTPUTS))
+
+        batch = np.array(batch)
+        self._get_graph()
+        if precision == 'float32':
+            fetches = self._fetches
+        else:
+            fetches = self._get_precision_fetches(precision)
+            missing = [o for o in outputs if o not in fetches]
+            if missing:
+                raise ValueError('Outputs %s are only available in float32'
+                                 % missing)
+
+        self._load_vars(variable_path)
+
+        num_scored = batch.shape[1]
+        if batch_out is None:
+            # batch_out is only used by the loss, but always needs to be fed in
+            if self._char_ids:
+                batch_out = np.zeros_like(batch)
+            else:
+                batch_out = np.zeros(batch.shape[:2] + (self._output_size,))
+            if 'loss' in outputs or 'losses' in outputs:
+                batch_out[:, :-1] = batch[:, 1:]
+                num_scored -= 1
+
+        feed_dict = self._feed_dict(batch, batch_out, mask)
+        if state is not None:
+            feed_dict[self._initial_state] = state
+        fetched = self._session.run([fetches[o] for o in outputs], feed_dict)
+
+        results = []
+        for name, value in zip(outputs, fetched):
+            if name in ('predictions', 'losses', 'gradients', 'saliency'):
+                value = np.swapaxes(value, 0, 1)
+                if name == 'losses' and num_scored < batch.shape[1]:
+                    # the loss against the zero target of the last timestep
+                    value = value.copy()
+                    value[:, num_scored:] = 0.
+            elif name == 'loss':
+                scored = np.ones(batch.shape[:2]) if mask is None else mask
+                scored = np.sum(np.asarray(scored)[:, :num_scored])
+                value = float(np.sum(value[:num_scored]) / max(scored, 1.))
+            results.append(value)
+
+        return tuple(results)
+
+    def stream(self, batches, outputs=('predictions', 'loss', 'indicators'),
+               batches_out=None, variable_path='./hmlstm_ckpt', state=None,
+               precision='float32'):
+        """
+        Run the network over consecutive chunks of the same sequences, one
+        batch at a time, starting each chunk from the final state of the one
+        before. Only one chunk is held in memory at a time, and the outputs
+        are the same as for the sequences in one piece.
+
+        params:
+        ---
+        batches: iterable of batches, where row b of a batch continues row b
+            of the batch before. Dimensions as for infer.
+        outputs: as for infer
+        batches_out: iterable of targets for the loss, one per batch. If
+            None, the loss of each chunk is computed as in infer, without a
+            target for its last timestep, whose entry in the losses is 0.
+        variable_path: as for infer
+        state: the state to start the first chunk from, defaults to zeros
+        precision: as for infer
+
+        returns:
+        ---
+        a generator of infer's results, one tuple per chunk
+        """
+
+        outputs = tuple(outputs)
+        fetches = outputs if 'state' in outputs else outputs + ('state',)
+        if batches_out is None:
+            batches_out = itertools.repeat(None)
+
+        for batch, batch_out in zip(batches, batches_out):
+            results = self.infer(batch, fetches, batch_out=batch_out,
+                                 variable_path=variable_path, state=state,
+                                 precision=precision)
+            state = results[fetches.index('state')]
+            yield results[:len(outputs)]
 
     def predict(self, batch, variable_path='./hmlstm_ckpt',
                 return_gradients=False, return_loss=False):
@@ -387,40 +989,19 @@ class HMLSTMNetwork(object):
         predictions for the batch
         """
 
-        batch = np.array(batch)
-        # loss is only for computing loss/BPC
-        _, loss, _, predictions = self._get_graph()
-
-        self._load_vars(variable_path)
-
-        # batch_out is not used for prediction, but needs to be fed in
-        batch_out_size = (batch.shape[1], batch.shape[0], self._output_size)
-        gradients = tf.gradients(predictions[-1:, :], self.batch_in)
-        _predictions, _gradients = self._session.run([predictions, gradients], {
-            self.batch_in: np.swapaxes(batch, 0, 1),
-            self.batch_out: np.zeros(batch_out_size),
-        })
-
         # for computing loss/BPC only
         if return_loss:
-            # Since batch_size = 1 for test, batch[0] pick the first and the only one batch
-            # [batch[0][:-1, :]] preserves batch dimensions of:
-            #     [*batch_size*, num_timesteps, output_size]
-            batch_in = np.array([batch[0][:-1, :]])
-            batch_out = np.array([batch[0][1:, :]])
-            feed_dict = {
-                self.batch_in: np.swapaxes(batch_in, 0, 1),
-                self.batch_out: np.swapaxes(batch_out, 0, 1),
-            }
-            _, _loss = self._session.run([_, loss], feed_dict)
-            print('loss:', _loss)
-            return np.swapaxes(_predictions, 0, 1), _loss
+            predictions, loss = self.infer(batch, ('predictions', 'loss'),
+                                           variable_path=variable_path)
+            print('loss:', loss)
+            return predictions, loss
 
         if return_gradients:
-            return tuple(np.swapaxes(r, 0, 1) for
-                         r in (_predictions, _gradients[0]))
+            return self.infer(batch, ('predictions', 'gradients'),
+                              variable_path=variable_path)
 
-        return np.swapaxes(_predictions, 0, 1)
+        return self.infer(batch, ('predictions',),
+                          variable_path=variable_path)[0]
 
     def predict_boundaries(self, batch, variable_path='./hmlstm_ckpt'):
         """
@@ -441,25 +1022,75 @@ class HMLSTMNetwork(object):
         indicator values for ever layer at every timestep
         """
 
-        batch = np.array(batch)
-        _, _, indicators, _ = self._get_graph()
-
-        self._load_vars(variable_path)
-
-        # batch_out is not used for prediction, but needs to be fed in
-        batch_out_size = (batch.shape[1], batch.shape[0], self._output_size)
-        _indicators = self._session.run(indicators, {
-            self.batch_in: np.swapaxes(batch, 0, 1),
-            self.batch_out: np.zeros(batch_out_size),
-        })
-
-        return np.array(_indicators)
+        indicators, = self.infer(batch, ('indicators',),
+                                 variable_path=variable_path)
+        return np.array(indicators)
 
     def _get_graph(self):
         if self._graph is None:
             self._graph = self.network(reuse=False)
+            _, _, indicators, predictions, losses, state = self._graph
+            # built once here rather than per call, so that repeated calls
+            # to predict do not keep adding ops to the graph
+            gradients = tf.gradients(predictions[-1:, :], self.batch_in)[0]
+            saliency = tf.reduce_sum(tf.abs(gradients), axis=2)  # [T, B]
+            self._fetches = {
+                'predictions': predictions,
+                'loss': losses,
+                'losses': losses,
+                'indicators': indicators,
+                'gradients': gradients,
+                'saliency': saliency,
+                'state': state,
+            }
         return self._graph
 
+    def _get_precision_fetches(self, precision):
+        '''
+        fetches of infer with the recurrence and the output module in a
+        reduced precision, e.g. 'float16' or 'bfloat16', built on first use.
+        They share the variables and placeholders of the float32 graph, and
+        the softmax, the loss and the outputs are float32. There is no train
+        op and no gradients.
+        '''
+        self._get_graph()
+        if precision not in self._precision_fetches:
+            elem_len = (sum(self._hidden_state_sizes) * 2) + self._num_layers
+            with tf.name_scope(precision):
+                indicators, predictions, losses, state = self._tower(
+                    self.batch_in, self._targets, self.mask,
+                    self._initial_state, elem_len, True,
+                    tf.as_dtype(precision))
+            self._precision_fetches[precision] = {
+                'predictions': predictions,
+                'loss': losses,
+                'losses': losses,
+                'indicators': indicators,
+                'state': state,
+            }
+        return self._precision_fetches[precision]
+
+    def _feed_dict(self, batch_in, batch_out, mask=None):
+        '''
+        batch_in, batch_out: batch major batches, [B, T, _] or, with
+            char_ids, [B, T]
+        mask: optional [B, T] mask
+
+        feed_dict: values for the input placeholders, time major for
+            one-hot batches
+        '''
+        if self._char_ids:
+            # transposed in the graph
+            feed_dict = {self.ids_in: batch_in, self.ids_out: batch_out}
+        else:
+            feed_dict = {
+                self.batch_in: np.swapaxes(batch_in, 0, 1),
+                self.batch_out: np.swapaxes(batch_out, 0, 1),
+            }
+        if mask is not None:
+            feed_dict[self.mask] = mask
+        return feed_dict
+
     def _load_vars(self, variable_path):
         if self._session is None:
             try:
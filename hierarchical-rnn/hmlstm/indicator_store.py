@@ -0,0 +1,149 @@
+import datetime
+import json
+import os
+import numpy as np
+
+# one file of packed bits per layer and an index, in a directory per
+# checkpoint, see IndicatorWriter
+BITS_EXT = '.bits'
+INDEX_NAME = 'index.json'
+
+
+def checkpoint_name(variable_path):
+    """
+    Name of the directory of a trained checkpoint in an indicator store: the
+    checkpoint's name and the time it was saved, so that two models saved
+    to the same variable_path, e.g. from the same configuration, do not
+    overwrite each other's indicators.
+
+    :param variable_path: as given to HMLSTMNetwork.save_variables
+    :return: e.g. 'text8-20171205-141502'
+    """
+    name = os.path.basename(os.path.normpath(variable_path))
+    index = variable_path + '.index'
+    if not os.path.exists(index):
+        return name
+    saved = datetime.datetime.fromtimestamp(os.path.getmtime(index))
+    return '%s-%s' % (name, saved.strftime('%Y%m%d-%H%M%S'))
+
+
+def _layer_path(directory, layer):
+    return os.path.join(directory, 'layer_%d%s' % (layer, BITS_EXT))
+
+
+class IndicatorWriter(object):
+    """
+    Append boundary indicators to bit-packed files, one bit per character
+    and layer, under <directory>/<checkpoint>/: layer_<l>.bits for every
+    layer l, bottom layer first as returned by the network, and index.json
+    with the number of layers and of characters. The directory is named
+    after the checkpoint the indicators were predicted with, see
+    checkpoint_name, and is overwritten by another run of the same
+    checkpoint only.
+
+    Bits are written 8 at a time as they come in; the last byte is padded
+    with zeros on close.
+    """
+
+    def __init__(self, directory, checkpoint, num_layers):
+        self.path = os.path.join(directory, checkpoint)
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        self._num_layers = num_layers
+        self._files = [open(_layer_path(self.path, l), 'wb')
+                       for l in range(num_layers)]
+        # [num_layers, < 8] bits not written yet
+        self._pending = np.zeros((num_layers, 0), dtype=bool)
+        self._length = 0
+
+    def append(self, indicators):
+        """
+        :param indicators: [num_layers, m] indicators of the next m
+            characters
+        """
+        bits = np.concatenate(
+            [self._pending, np.asarray(indicators) > .5], axis=1)
+        complete = bits.shape[1] // 8 * 8
+        for f, row in zip(self._files, np.packbits(bits[:, :complete], axis=1)):
+            f.write(row.tobytes())
+        self._pending = bits[:, complete:]
+        self._length += np.shape(indicators)[1]
+
+    def close(self):
+        for f, row in zip(self._files, np.packbits(self._pending, axis=1)):
+            f.write(row.tobytes())
+            f.close()
+        self._pending = np.zeros((self._num_layers, 0), dtype=bool)
+        with open(os.path.join(self.path, INDEX_NAME), 'w') as f:
+            json.dump({'num_layers': self._num_layers,
+                       'length': self._length}, f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def save_indicators(directory, checkpoint, indicators):
+    """
+    :param indicators: [num_layers, num_chars] indicators of a whole corpus
+    :return: path of the checkpoint directory
+    """
+    with IndicatorWriter(directory, checkpoint, len(indicators)) as writer:
+        writer.append(indicators)
+    return writer.path
+
+
+class IndicatorStore(object):
+    """
+    Read access to the indicators written by IndicatorWriter under a
+    directory, for any number of checkpoints. The bit files are memory
+    mapped, and only the bytes of the characters read are unpacked.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    @property
+    def checkpoints(self):
+        return sorted(
+            name for name in os.listdir(self.directory)
+            if os.path.exists(os.path.join(self.directory, name, INDEX_NAME)))
+
+    def index(self, checkpoint):
+        """
+        :return: dict with 'num_layers' and 'length', the number of
+            characters
+        """
+        with open(os.path.join(self.directory, checkpoint, INDEX_NAME)) as f:
+            return json.load(f)
+
+    def packed(self, checkpoint, layer):
+        """
+        :return: uint8 np.memmap of the packed bits of a layer
+        """
+        return np.memmap(_layer_path(os.path.join(self.directory, checkpoint),
+                                     layer), dtype=np.uint8, mode='r')
+
+    def read(self, checkpoint, layer=None, start=0, stop=None):
+        """
+        :param layer: layer index, or None for all layers
+        :param start, stop: range of characters
+        :return: bool array, [stop - start] for one layer or
+            [num_layers, stop - start] for all of them
+        """
+        index = self.index(checkpoint)
+        if layer is None:
+            return np.stack([self.read(checkpoint, l, start, stop)
+                             for l in range(index['num_layers'])])
+
+        length = index['length']
+        stop = length if stop is None else min(stop, length)
+        start = min(start, stop)
+        if start == stop:
+            return np.zeros(0, dtype=bool)
+        first = start // 8
+        packed = self.packed(checkpoint, layer)[first:-(-stop // 8)]
+        bits = np.unpackbits(packed)
+        return bits[start - first * 8:stop - first * 8].astype(bool)
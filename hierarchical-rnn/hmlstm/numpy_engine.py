@@ -0,0 +1,263 @@
+import re
+import numpy as np
+
+# written next to a checkpoint by HMLSTMNetwork.save_variables
+NUMPY_EXT = '.npz'
+
+_KERNEL = re.compile(r'cell_(\d+)/hmlstm_cell/(weights|kernel)$')
+
+
+def _sigmoid(x):
+    # does not overflow for large negative x, unlike 1 / (1 + exp(-x))
+    return .5 * (np.tanh(.5 * x) + 1.)
+
+
+def convert_checkpoint(path='./hmlstm_ckpt'):
+    """
+    Write the trainable variables of a checkpoint saved before
+    save_variables also exported them for NumpyHMLSTM. This is the only
+    function of the module that needs tensorflow.
+
+    :param path: checkpoint path, as given to save_variables
+    :return: path of the written variables
+    """
+    import tensorflow as tf
+
+    reader = tf.train.NewCheckpointReader(path)
+    names = [n for n in reader.get_variable_to_shape_map()
+             if re.match(r'(gates_vars|embedding_vars|output_module_vars)/', n)
+             or _KERNEL.search(n)]
+    # skip the optimizer's slots, e.g. '.../weights/Adam'
+    names = [n for n in names if not n.endswith(('/Adam', '/Adam_1'))]
+    np.savez(path + NUMPY_EXT, **{n: reader.get_tensor(n) for n in names})
+    return path + NUMPY_EXT
+
+
+class NumpyHMLSTM(object):
+    def __init__(self, variables):
+        """
+        Inference for a trained HMLSTMNetwork with numpy only: no tensorflow
+        import, graph or session.
+
+        Runs the same recurrence as FusedHMLSTMCell, timestep by timestep
+        but vectorized over the batch, followed by the gated output module
+        over all timesteps at once.
+
+        params:
+        ---
+        variables: dict of variable name to array, as written by
+            HMLSTMNetwork.save_variables, see load
+        """
+        kernels = {}
+        for name, value in variables.items():
+            match = _KERNEL.search(name)
+            if match:
+                kernels[int(match.group(1))] = value
+        self._num_layers = len(kernels)
+        kernels = [kernels[l] for l in range(self._num_layers)]
+        self._hidden_state_sizes = [(k.shape[1] - 1) // 4 for k in kernels]
+
+        def get(name):
+            return variables[name].astype(np.float32)
+
+        sizes = self._hidden_state_sizes
+        recurrent, above, below = [], [], []
+        for l, (kernel, size) in enumerate(zip(kernels, sizes)):
+            # rows are [h; z * h_above; z_below * h_below], and the last
+            # layer's h_above is as large as the first layer's h
+            h_above_size = sizes[(l + 1) % self._num_layers]
+            kernel = kernel.astype(np.float32)
+            recurrent.append(kernel[:size])
+            above.append(kernel[size:size + h_above_size])
+            below.append(kernel[size + h_above_size:])
+
+        self._input_size = below[0].shape[0]
+        # h_l @ [recurrent_l, above_(l - 1)], see FusedHMLSTMCell
+        self._h_kernels = [recurrent[0]] + [
+            np.concatenate((recurrent[l], above[l - 1]), axis=1)
+            for l in range(1, self._num_layers)]
+        self._below_kernels = below
+
+        # for skip_copies: the kernels apart, and split into the columns of
+        # the gates and the column of the boundary detector
+        self._split_kernels = [
+            [(np.ascontiguousarray(k[:, :4 * size]),
+              np.ascontiguousarray(k[:, 4 * size]))
+             for k in (recurrent[l], above[l], below[l])]
+            for l, size in enumerate(sizes)]
+        # share of the upper layers' rows skipped by the last run
+        self.skip_ratio = 0.
+
+        self._gates = np.concatenate(
+            [get('gates_vars/gate_%d' % l) for l in range(self._num_layers)],
+            axis=1)                                         # [sum(h_l), L]
+        self._embed_weights = get('embedding_vars/embed_weights')
+        self._output_weights = [
+            (get('output_module_vars/w%d' % i), get('output_module_vars/b%d' % i))
+            for i in (1, 2, 3)]
+
+    @classmethod
+    def load(cls, path='./hmlstm_ckpt'):
+        """
+        :param path: the variable_path given to HMLSTMNetwork.save_variables
+        :return: NumpyHMLSTM
+        """
+        if not path.endswith(NUMPY_EXT):
+            path += NUMPY_EXT
+        with np.load(path) as variables:
+            return cls(dict(variables.items()))
+
+    @property
+    def num_layers(self):
+        return self._num_layers
+
+    def run(self, batch, skip_copies=False):
+        """
+        params:
+        ---
+        batch: integer character ids with dimensions
+            [batch_size, num_timesteps], or inputs with dimensions
+            [batch_size, num_timesteps, input_size]
+        skip_copies: bool, whether to leave out the gates of the rows of
+            the upper layers that copy their state, i.e. where neither the
+            layer nor the one below it had a boundary. Only the boundary
+            detector is computed for them. Same results; faster the more
+            rarely the upper layers fire, see skip_ratio.
+
+        returns:
+        ---
+        predictions with dimensions [batch_size, num_timesteps, output_size],
+        and indicators with dimensions [batch_size, num_layers, num_timesteps]
+        """
+        batch = np.asarray(batch)
+        if np.issubdtype(batch.dtype, np.integer):
+            # one-hot inputs times the kernel, i.e. a lookup of its rows
+            projected = self._below_kernels[0][batch]       # [B, T, 4h_0+1]
+        else:
+            projected = np.dot(batch.astype(np.float32),
+                               self._below_kernels[0])
+        batch_size, num_steps = projected.shape[:2]
+        sizes = self._hidden_state_sizes
+
+        cs = [np.zeros((batch_size, s), dtype=np.float32) for s in sizes]
+        hs = [np.zeros((batch_size, s), dtype=np.float32) for s in sizes]
+        zs = [np.zeros((batch_size, 1), dtype=np.float32) for _ in sizes]
+        # [T, B, sum(h_l)] and [T, B, L], for the output module
+        all_hs = np.empty((num_steps, batch_size, sum(sizes)), dtype=np.float32)
+        all_zs = np.empty((num_steps, batch_size, self._num_layers),
+                          dtype=np.float32)
+
+        num_skipped = 0
+        for t in range(num_steps):
+            if skip_copies:
+                num_skipped += self._sparse_step(cs, hs, zs, projected[:, t])
+                all_hs[t] = np.concatenate(hs, axis=1)
+                all_zs[t] = np.concatenate(zs, axis=1)
+                continue
+
+            products = [np.dot(h, k) for h, k in zip(hs, self._h_kernels)]
+            z_below = np.ones((batch_size, 1), dtype=np.float32)
+            for l, size in enumerate(sizes):
+                pre = products[l][:, :4 * size + 1]
+                if l + 1 < self._num_layers:
+                    pre = pre + zs[l] * products[l + 1][:, 4 * sizes[l + 1] + 1:]
+                if l == 0:
+                    pre = pre + projected[:, t]
+                else:
+                    pre = pre + z_below * np.dot(hs[l - 1],
+                                                 self._below_kernels[l])
+
+                i = _sigmoid(pre[:, :size])
+                g = np.tanh(pre[:, size:2 * size])
+                f = _sigmoid(pre[:, 2 * size:3 * size])
+                o = _sigmoid(pre[:, 3 * size:4 * size])
+                new_z = np.round(_sigmoid(pre[:, 4 * size:]))
+
+                # copy if z == 0 and z_below == 0, flush if z == 1, update
+                # otherwise
+                z = zs[l]
+                copy = (1. - z) * (1. - z_below)
+                update = (1. - z) * z_below
+                cs[l] = copy * cs[l] + (1. - copy) * (i * g + update * f * cs[l])
+                hs[l] = copy * hs[l] + (1. - copy) * o * np.tanh(cs[l])
+                zs[l] = z_below = new_z
+
+            all_hs[t] = np.concatenate(hs, axis=1)
+            all_zs[t] = np.concatenate(zs, axis=1)
+
+        num_rows = (self._num_layers - 1) * batch_size * num_steps
+        self.skip_ratio = num_skipped / float(max(num_rows, 1))
+
+        predictions = self._output_module(
+            all_hs.reshape(num_steps * batch_size, -1))
+        predictions = predictions.reshape(num_steps, batch_size, -1)
+        return (np.swapaxes(predictions, 0, 1),
+                np.transpose(all_zs, [1, 2, 0]))
+
+    def _sparse_step(self, cs, hs, zs, projected):
+        '''
+        one timestep of run with skip_copies, updating cs, hs and zs
+
+        projected: [B, 4h_0+1], the first layer's bottom-up pre-activations
+
+        num_skipped: number of rows of the upper layers that were copied
+        '''
+        num_skipped = 0
+        z_below = None
+        for l, size in enumerate(self._hidden_state_sizes):
+            (rec, rec_z), (above, above_z), (below, below_z) = \
+                self._split_kernels[l]
+            z = zs[l]
+            has_above = l + 1 < self._num_layers
+
+            # the boundary detector, for every row
+            z_tilde = np.dot(hs[l], rec_z)
+            if has_above:
+                z_tilde += z[:, 0] * np.dot(hs[l + 1], above_z)
+            if l == 0:
+                z_tilde += projected[:, 4 * size]
+                rows = slice(None)
+                zb = np.ones_like(z)
+            else:
+                z_tilde += z_below[:, 0] * np.dot(hs[l - 1], below_z)
+                zb = z_below
+                # copy if z == 0 and z_below == 0
+                rows = np.flatnonzero((z[:, 0] + zb[:, 0]) > 0)
+                num_skipped += len(z) - len(rows)
+
+            # the gates, for the rows that flush or update
+            h, z, zb = hs[l][rows], z[rows], zb[rows]
+            pre = np.dot(h, rec)
+            if has_above:
+                pre += z * np.dot(hs[l + 1][rows], above)
+            if l == 0:
+                pre += projected[:, :4 * size]
+            else:
+                pre += zb * np.dot(hs[l - 1][rows], below)
+
+            i = _sigmoid(pre[:, :size])
+            g = np.tanh(pre[:, size:2 * size])
+            f = _sigmoid(pre[:, 2 * size:3 * size])
+            o = _sigmoid(pre[:, 3 * size:4 * size])
+            # flush if z == 1, update otherwise
+            c = i * g + (1. - z) * zb * f * cs[l][rows]
+            cs[l][rows] = c
+            hs[l][rows] = o * np.tanh(c)
+            zs[l] = z_below = np.round(_sigmoid(z_tilde))[:, None]
+        return num_skipped
+
+    def _output_module(self, hidden_states):
+        '''
+        hidden_states: [N, sum(h_l)]
+
+        predictions: [N, output_size]
+        '''
+        gates = _sigmoid(np.dot(hidden_states, self._gates))   # [N, L]
+        gates = np.repeat(gates, self._hidden_state_sizes, axis=1)
+        embedding = np.maximum(
+            np.dot(gates * hidden_states, self._embed_weights), 0)
+
+        (w1, b1), (w2, b2), (w3, b3) = self._output_weights
+        l1 = np.tanh(np.dot(embedding, w1) + b1)
+        l2 = np.tanh(np.dot(l1, w2) + b2)
+        return np.dot(l2, w3) + b3
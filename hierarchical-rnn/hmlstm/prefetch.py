@@ -0,0 +1,77 @@
+import queue
+import threading
+import time
+
+_DONE = object()
+
+
+class Prefetcher(object):
+    """
+    Iterate over items that a background thread takes from an iterable up
+    to size items ahead, so that preparing the next batches overlaps with
+    the session.run of the current one. Exceptions of the iterable are
+    raised in the iterating thread.
+
+    wait_time is the total time spent waiting for items, i.e. for input
+    that was not ready yet. With size 0 items are taken in the iterating
+    thread, and wait_time is the time spent preparing them.
+    """
+
+    def __init__(self, iterable, size=2):
+        self.wait_time = 0.
+        self._iterator = iter(iterable)
+        self._size = size
+        self._thread = None
+        if size > 0:
+            self._queue = queue.Queue(maxsize=size)
+            self._stopped = threading.Event()
+            self._thread = threading.Thread(target=self._fill)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _put(self, item):
+        # gives up once close is called, rather than block on a full queue
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(item, timeout=.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _fill(self):
+        try:
+            for item in self._iterator:
+                if not self._put((item, None)):
+                    return
+        except Exception as e:
+            self._put((_DONE, e))
+            return
+        self._put((_DONE, None))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start = time.time()
+        try:
+            if self._thread is None:
+                return next(self._iterator)
+            item, error = self._queue.get()
+        finally:
+            self.wait_time += time.time() - start
+        if item is _DONE:
+            self._thread = None
+            self._iterator = iter(())
+            if error is not None:
+                raise error
+            raise StopIteration
+        return item
+
+    def close(self):
+        """stop the background thread, e.g. when leaving a loop early"""
+        if self._thread is not None:
+            self._stopped.set()
+            self._thread.join()
+            self._thread = None
+            self._iterator = iter(())
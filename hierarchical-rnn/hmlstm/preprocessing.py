@@ -1,91 +1,545 @@
-import re
+import copy
+import json
+import os
 import numpy as np
 from string import ascii_lowercase
 
 
-def text(text_path, truncate_len, step_size, batch_size, num_chars=None):
-    signals = load_text(text_path, truncate_len, step_size, batch_size, num_chars)
+# binary corpus format, see save_corpus
+CORPUS_MAGIC = b'HMLSTMIDS'
+CORPUS_HEADER_SIZE = 4096
+CORPUS_EXT = '.ids'
 
-    hot = [(one_hot_encode(intext), one_hot_encode(outtext))
-           for intext, outtext in signals]
+# (start, end) of every sentence of a corpus, one per line, written by
+# treebank/convert_boundary.py next to sentences.txt
+OFFSETS_EXT = '.offsets'
 
-    return hot
+# characters in id order; every character outside of a-z maps to the
+# last id, which decodes to a space
+VOCAB = ascii_lowercase + ' '
 
+# byte value -> character id, folding upper case into lower case
+CHAR_TABLE = np.full(256, len(VOCAB) - 1, dtype=np.uint8)
+for _i, _c in enumerate(ascii_lowercase):
+    CHAR_TABLE[ord(_c)] = _i
+    CHAR_TABLE[ord(_c.upper())] = _i
+
+# character id -> byte value
+_VOCAB_BYTES = np.frombuffer(VOCAB.encode('ascii'), dtype=np.uint8)
+
+_SPACES = np.zeros(256, dtype=bool)
+_SPACES[[ord(' '), ord('\n')]] = True
+
+
+def _read_ids(f, num_chars=None, chunk_size=2 ** 22):
+    """
+    Generator of uint8 character id chunks read from an open text file.
+
+    Newlines become spaces, runs of spaces are collapsed and upper case is
+    folded into lower case, also across chunk edges.
+    """
+    prev_space = False
+    remaining = num_chars
+    while remaining is None or remaining > 0:
+        size = chunk_size if remaining is None else min(chunk_size, remaining)
+        text = f.read(size)
+        if not text:
+            break
+        if remaining is not None:
+            remaining -= len(text)
+
+        # one byte per character; non-ascii characters become '?'
+        raw = np.frombuffer(text.encode('ascii', errors='replace'),
+                            dtype=np.uint8)
+        space = _SPACES[raw]
+        repeated = np.empty_like(space)
+        repeated[0] = prev_space
+        repeated[1:] = space[:-1]
+        yield CHAR_TABLE[raw[~(space & repeated)]]
+        prev_space = space[-1]
+
+
+def corpus_path(text_path):
+    """
+    :return: where save_corpus writes the binary corpus of text_path by
+        default, i.e. text_path with its extension replaced by '.ids'
+    """
+    return os.path.splitext(text_path)[0] + CORPUS_EXT
+
+
+def offsets_path(text_path):
+    """
+    :return: where the sentence offsets of text_path are stored, i.e.
+        text_path with its extension replaced by '.offsets'
+    """
+    return os.path.splitext(text_path)[0] + OFFSETS_EXT
+
+
+def load_offsets(text_path):
+    """
+    :param text_path: path of the text file, or of its binary corpus
+    :return: [num_sentences, 2] int64 array of (start, end) character
+        offsets of every sentence
+    """
+    return np.loadtxt(offsets_path(text_path), dtype=np.int64, ndmin=2)
+
+
+def save_corpus(text_path, path=None):
+    """
+    Convert a text file once into a binary corpus that load_corpus can map
+    into memory.
+
+    The file starts with a header of CORPUS_HEADER_SIZE bytes: the magic
+    string followed by a JSON object with the vocabulary, the number of ids
+    and the text file it was made from. The uint8 character ids follow.
+
+    :param text_path: path of the text file
+    :param path: path of the binary corpus, defaults to corpus_path(text_path)
+    :return: path of the binary corpus
+    """
+    if path is None:
+        path = corpus_path(text_path)
+
+    length = 0
+    with open(text_path, 'r') as f, open(path, 'wb') as out:
+        out.seek(CORPUS_HEADER_SIZE)
+        for ids in _read_ids(f):
+            out.write(ids.tobytes())
+            length += len(ids)
+
+        header = json.dumps({'vocab': VOCAB, 'length': length,
+                             'source': os.path.abspath(text_path)})
+        header = CORPUS_MAGIC + header.encode('utf-8')
+        if len(header) > CORPUS_HEADER_SIZE:
+            raise ValueError('Corpus header is too long: %s' % header)
+        out.seek(0)
+        out.write(header.ljust(CORPUS_HEADER_SIZE, b' '))
+
+    return path
+
+
+def is_corpus(path):
+    with open(path, 'rb') as f:
+        return f.read(len(CORPUS_MAGIC)) == CORPUS_MAGIC
+
+
+def load_corpus(path):
+    """
+    Map a binary corpus written by save_corpus into memory, read-only. The
+    ids are only paged in when used, and processes mapping the same file
+    share its pages.
+
+    :param path: path of the binary corpus
+    :return: uint8 np.memmap of character ids
+    """
+    with open(path, 'rb') as f:
+        header = f.read(CORPUS_HEADER_SIZE)
+    if not header.startswith(CORPUS_MAGIC):
+        raise ValueError('%s is not a binary corpus' % path)
+    header = json.loads(header[len(CORPUS_MAGIC):].decode('utf-8'))
+    if header['vocab'] != VOCAB:
+        raise ValueError('%s was written with vocabulary %r, expected %r'
+                         % (path, header['vocab'], VOCAB))
+
+    if header['length'] == 0:
+        return np.zeros(0, dtype=np.uint8)
+    return np.memmap(path, dtype=np.uint8, mode='r',
+                     offset=CORPUS_HEADER_SIZE, shape=(header['length'],))
+
+
+def load_ids(text_path, num_chars=None, chunk_size=2 ** 22):
+    """
+    Load a corpus as a uint8 array of character ids.
+
+    If text_path is a binary corpus written by save_corpus, or has one next
+    to it at corpus_path(text_path) that is newer than the text, the corpus
+    is memory mapped and num_chars counts normalized characters. Otherwise
+    the text is read chunk by chunk and normalized on the way (see _read_ids)
+    so only the ids, one byte per character, are ever held in memory.
+
+    :param text_path: path of the text file or of a binary corpus
+    :param num_chars: read at most this many characters of the file
+    :param chunk_size: number of characters to read at a time
+    :return: uint8 array of character ids
+    """
+    binary = corpus_path(text_path)
+    if os.path.exists(text_path) and is_corpus(text_path):
+        binary = text_path
+    elif not os.path.exists(binary) or (
+            os.path.exists(text_path)
+            and os.path.getmtime(text_path) > os.path.getmtime(binary)):
+        binary = None
+
+    if binary is not None:
+        return load_corpus(binary)[:num_chars]
 
-def load_text(text_path, truncate_len, step_size, batch_size, num_chars):
     with open(text_path, 'r') as f:
-        text = f.read(num_chars)
-        text = text.replace('\n', ' ')
-        text = re.sub(' +', ' ', text).lower()
+        chunks = list(_read_ids(f, num_chars, chunk_size))
+    if not chunks:
+        return np.zeros(0, dtype=np.uint8)
+    return np.concatenate(chunks)
 
-    signals = []
-    start = 0
-    while start + truncate_len < len(text):
-        intext = text[start:start + truncate_len]
-        outtext = text[start + 1:start + truncate_len + 1]
-        signals.append((intext, outtext))
-        start += step_size
 
-    return signals
+class CharBatches(object):
+    """
+    Lazy sequence of batches of overlapping windows over character ids.
 
+    Window k covers ids[k * step_size + offset:][:truncate_len], and batch n
+    holds windows n * batch_size to (n + 1) * batch_size - 1. A batch is only
+    cut out of the id array when it is indexed or iterated over, so memory
+    use does not depend on the number of batches. Slicing returns another
+    lazy CharBatches.
 
-def one_hot_encode(text):
-    out = np.zeros((len(text), 27))
+    Batches are [batch_size, truncate_len] uint8 ids, or float32 one-hot
+    arrays of [batch_size, truncate_len, len(VOCAB)] if one_hot is True.
+    """
 
-    def get_index(char):
-        try:
-            return ascii_lowercase.index(char)
-        except:
-            return 26
+    def __init__(self, ids, batch_size, truncate_len, step_size, offset=0,
+                 num_batches=None, one_hot=False):
+        self._ids = ids
+        self._batch_size = batch_size
+        self._truncate_len = truncate_len
+        self._step_size = step_size
+        self._offset = offset
+        self._one_hot = one_hot
 
-    for i, t in enumerate(text):
-        out[i, get_index(t)] = 1
+        # same windows as 'while start + truncate_len < len(text)'
+        if len(ids) > truncate_len:
+            num_windows = (len(ids) - truncate_len - 1) // step_size + 1
+        else:
+            num_windows = 0
+        available = num_windows // batch_size
+        if num_batches is None or num_batches > available:
+            num_batches = available
+        self._batches = range(num_batches)
 
-    return out
+    def __len__(self):
+        return len(self._batches)
 
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            sliced = copy.copy(self)
+            sliced._batches = self._batches[index]
+            return sliced
 
-def get_text(encoding):
-    prediction = ''
+        first = self._batches[index] * self._batch_size
+        start = self._offset + first * self._step_size
+        # view of the batch's windows, copied out below
+        windows = np.lib.stride_tricks.as_strided(
+            self._ids[start:],
+            shape=(self._batch_size, self._truncate_len),
+            strides=(self._step_size * self._ids.itemsize, self._ids.itemsize))
+        batch = np.array(windows)                   # [B, T]
+
+        if self._one_hot:
+            return np.eye(len(VOCAB), dtype=np.float32)[batch]
+        return batch
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class CorpusStreams(object):
+    """
+    A corpus cut into batch_size contiguous rows, which are read
+    truncate_len characters at a time, for HMLSTMNetwork.stream.
+
+    Row b holds the characters from b * ceil(n / batch_size) on, so a batch
+    runs batch_size far apart parts of the corpus side by side. The last
+    chunk is as long as what is left of the rows, and the end of the last
+    row is padded. Targets are the next character in the corpus, and weights
+    are 1 where there is one, i.e. everywhere but at the padding and at the
+    last character of the corpus.
+    """
+
+    def __init__(self, ids, batch_size, truncate_len):
+        self._length = len(ids)
+        self._truncate_len = truncate_len
+        row_len = -(-len(ids) // batch_size)
+
+        padded = np.zeros(batch_size * row_len + 1, dtype=np.uint8)
+        padded[:len(ids)] = ids
+        weights = np.zeros(batch_size * row_len, dtype=np.float32)
+        weights[:len(ids) - 1] = 1
+
+        self._rows_in = padded[:-1].reshape(batch_size, row_len)
+        self._rows_out = padded[1:].reshape(batch_size, row_len)
+        self._weights = weights.reshape(batch_size, row_len)
+
+    def __len__(self):
+        return -(-self._rows_in.shape[1] // self._truncate_len)
+
+    def starts(self, index):
+        """
+        :return: [batch_size] positions in the corpus of the first
+            character of each row of chunk index
+        """
+        row_len = self._rows_in.shape[1]
+        return np.arange(self._rows_in.shape[0]) * row_len \
+            + index * self._truncate_len
 
-    for char in np.squeeze(encoding):
-        max_likelihood = np.where(char == np.max(char))[0][0]
-        if max_likelihood < 26:
-            prediction += ascii_lowercase[max_likelihood]
-        elif max_likelihood == 26:
-            prediction += ' '
+    def _chunks(self, rows):
+        for start in range(0, rows.shape[1], self._truncate_len):
+            yield rows[:, start:start + self._truncate_len]
 
-    return prediction
+    @property
+    def inputs(self):
+        """generator of [batch_size, <= truncate_len] uint8 ids"""
+        return self._chunks(self._rows_in)
+
+    @property
+    def targets(self):
+        """generator of [batch_size, <= truncate_len] uint8 ids"""
+        return self._chunks(self._rows_out)
+
+    @property
+    def weights(self):
+        """generator of [batch_size, <= truncate_len] float32 weights"""
+        return self._chunks(self._weights)
+
+    def join(self, chunks, axis=1):
+        """
+        Put per-chunk outputs back into corpus order.
+
+        :param chunks: one array per chunk, with the batch on axis 0 and
+            time on the given axis, e.g. [B, T, O] predictions with axis=1
+            or [B, L, T] indicators with axis=2
+        :param axis: the time axis of the chunks
+        :return: array with the corpus on axis 0, e.g. [n, O] or [n, L]
+        """
+        rows = np.moveaxis(np.concatenate(chunks, axis=axis), axis, 1)
+        return rows.reshape((-1,) + rows.shape[2:])[:self._length]
+
+
+class SentenceBatches(object):
+    """
+    Batches of whole sentences, padded to the longest sentence of each batch.
+
+    Sentences are sorted by length and batch n holds sentences
+    n * batch_size to (n + 1) * batch_size - 1 of that order, so a batch
+    only needs as much padding as its sentences differ in length. Batch i is
+    a tuple of [B, T] uint8 inputs, uint8 targets and a float32 mask, which
+    is 1 for the characters of the sentences and 0 for the padding after
+    them. The target of the last character of a sentence is the space that
+    follows it in the corpus.
+
+    Each sentence is meant to be run from a zero state, see
+    HMLSTMNetwork.train and HMLSTMNetwork.infer for masks.
+    """
+
+    def __init__(self, ids, offsets, batch_size, shuffle=False, seed=None):
+        """
+        :param ids: character ids of the corpus
+        :param offsets: [num_sentences, 2] (start, end) offsets into ids,
+            see load_offsets
+        :param batch_size: number of sentences per batch
+        :param shuffle: bool, whether to shuffle the order of the batches,
+            but not their sentences
+        :param seed: seed of the shuffle, drawn at random if None. The
+            seed used is kept in seed, e.g. to resume training with the
+            same order of the batches
+        """
+        self._ids = ids
+        self._offsets = np.asarray(offsets, dtype=np.int64)
+
+        lengths = self._offsets[:, 1] - self._offsets[:, 0]
+        order = np.argsort(lengths, kind='mergesort')
+        self._batches = [order[i:i + batch_size]
+                         for i in range(0, len(order), batch_size)]
+        if shuffle and seed is None:
+            seed = np.random.randint(2 ** 31 - 1)
+        self.seed = seed if shuffle else None
+        if shuffle:
+            np.random.RandomState(seed).shuffle(self._batches)
+
+    def __len__(self):
+        return len(self._batches)
+
+    def positions(self, index):
+        """
+        :return: [B, T] positions in the corpus of the characters of batch
+            index, 0 for padding, and a [B, T] bool mask, False for padding
+        """
+        starts, ends = self._offsets[self._batches[index]].T
+        positions = starts[:, None] + np.arange(np.max(ends - starts))
+        mask = positions < ends[:, None]
+        return np.where(mask, positions, 0), mask
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            sliced = copy.copy(self)
+            sliced._batches = self._batches[index]
+            return sliced
+
+        positions, mask = self.positions(index)
+        batch_in = np.where(mask, self._ids[positions], 0).astype(np.uint8)
+        # the corpus ends without a space after its last sentence
+        after = positions + 1
+        last = after == len(self._ids)
+        batch_out = self._ids[np.where(last, 0, after)]
+        batch_out = np.where(mask & ~last, batch_out,
+                             len(VOCAB) - 1).astype(np.uint8)
+        return batch_in, batch_out, mask.astype(np.float32)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    @property
+    def inputs(self):
+        """lazy sequence of the input batches"""
+        return _BatchField(self, 0)
+
+    @property
+    def targets(self):
+        """lazy sequence of the target batches"""
+        return _BatchField(self, 1)
+
+    @property
+    def masks(self):
+        """lazy sequence of the masks"""
+        return _BatchField(self, 2)
+
+    def sentences(self, index):
+        """
+        :return: indices into the offsets of the sentences of batch index
+        """
+        return self._batches[index]
+
+    def join(self, batches, axis=1, fill=0):
+        """
+        Put per-batch outputs back into corpus order.
+
+        :param batches: one array per batch, in batch order, with the batch
+            on axis 0 and time on the given axis, e.g. [B, T, O] predictions
+            with axis=1 or [B, L, T] indicators with axis=2
+        :param axis: the time axis of the batches
+        :param fill: value for the characters between sentences
+        :return: array with the corpus on axis 0, e.g. [n, O] or [n, L]
+        """
+        joined = None
+        for index, batch in enumerate(batches):
+            batch = np.moveaxis(batch, axis, 1)
+            if joined is None:
+                joined = np.full((len(self._ids),) + batch.shape[2:], fill,
+                                 dtype=batch.dtype)
+            positions, mask = self.positions(index)
+            joined[positions[mask]] = batch[mask]
+        return joined
+
+
+class _BatchField(object):
+    """one field of the (inputs, targets, mask) batches of SentenceBatches"""
+
+    def __init__(self, batches, field):
+        self._batches = batches
+        self._field = field
+
+    def __len__(self):
+        return len(self._batches)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return _BatchField(self._batches[index], self._field)
+        return self._batches[index][self._field]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+def encode_ids(text):
+    """
+    Map text to character ids through CHAR_TABLE.
+
+    :param text: a string, or a list of equally long strings
+    :return: uint8 ids, [T] for a string or [B, T] for a list of strings
+    """
+    if isinstance(text, str):
+        return CHAR_TABLE[np.frombuffer(
+            text.encode('ascii', errors='replace'), dtype=np.uint8)]
+    return np.stack([encode_ids(t) for t in text])
+
+
+def one_hot_encode(text):
+    """
+    :param text: a string, or a list of equally long strings
+    :return: one-hot encoding, [T, 27] for a string or [B, T, 27] for a list
+        of strings
+    """
+    return np.eye(len(VOCAB))[encode_ids(text)]
+
+
+def decode_ids(ids):
+    """
+    :param ids: character ids, [T] or [B, T]
+    :return: a string for [T], or a list of strings for [B, T]
+    """
+    ids = np.asarray(ids)
+    if ids.ndim > 1:
+        return [decode_ids(row) for row in ids]
+    # ids past the vocabulary do not decode to any character
+    ids = ids[ids < len(VOCAB)]
+    return _VOCAB_BYTES[ids].tobytes().decode('ascii')
+
+
+def get_text(encoding):
+    """
+    :param encoding: character ids [T] or [B, T], or one-hot encodings or
+        predictions [T, 27] or [B, T, 27]; leading singleton dimensions are
+        squeezed
+    :return: a string, or a list of strings for a batch
+    """
+    encoding = np.squeeze(encoding)
+    if not np.issubdtype(encoding.dtype, np.integer):
+        # most likely character at every timestep
+        encoding = np.argmax(encoding, axis=-1)
+    return decode_ids(np.atleast_1d(encoding))
 
 
 def prepare_inputs(batch_size=10,
                    truncate_len=1000,
                    text_path='text8.txt',
                    step_size=None,
-                   num_batches=None):
+                   num_batches=None,
+                   ids=False):
+    """
+    Cut a text file into batches of overlapping windows; the output windows
+    are the input windows shifted by one character.
+
+    :param batch_size: number of windows per batch
+    :param truncate_len: number of characters per window
+    :param text_path: path of the text file
+    :param step_size: distance between the starts of consecutive windows,
+        defaults to half of truncate_len
+    :param num_batches: maximum number of batches, defaults to as many as
+        the whole text allows
+    :param ids: bool, whether batches hold uint8 character ids
+        [batch_size, truncate_len] rather than float32 one-hot encodings
+        [batch_size, truncate_len, 27]
+    :return: lazy sequences of input and output batches, see CharBatches
+    """
 
     if step_size is None:
         step_size = truncate_len // 2
 
     if num_batches is None:
-        y = text(text_path, truncate_len, step_size, batch_size)
-        num_batches = len(y) // batch_size
-    elif num_batches is not None:
+        num_chars = None
+    else:
         if step_size > truncate_len:
             raise ValueError('Step size cannot be greater than truncate length')
         num_chars = batch_size * num_batches * truncate_len
-        y = text(text_path, truncate_len, step_size, batch_size, num_chars)
+    corpus = load_ids(text_path, num_chars)
 
-    batches_in = []
-    batches_out = []
-
-    for batch_number in range(num_batches):
-        start = batch_number * batch_size
-        end = start + batch_size
-        batches_in.append([i for i, _ in y[start:end]])
-        batches_out.append([o for _, o in y[start:end]])
+    batches_in, batches_out = (
+        CharBatches(corpus, batch_size, truncate_len, step_size, offset=offset,
+                    num_batches=num_batches, one_hot=not ids)
+        for offset in (0, 1))
 
     return batches_in, batches_out
 
+
 def convert_to_batches(signals, batch_size=10, steps_ahead=1):
     start = 0
     batches_in = []
@@ -1,6 +1,6 @@
 import matplotlib.pyplot as plt
+import numpy as np
 import sys
-from collections import defaultdict
 
 
 class Unbuffered(object):
@@ -40,12 +40,19 @@ def plot_indicators(truth, prediction, indicators):
     return f
 
 
+def _bit_string(layer):
+    # '0'/'1' characters of one layer's indicators
+    bits = np.asarray(layer).astype(np.uint8) + ord('0')
+    return bits.tobytes().decode('ascii')
+
+
 def viz_char_boundaries(truth, predictions, indicators, row_len=60):
+    bit_strings = [_bit_string(l) for l in reversed(indicators)]
     start = 0
     end = row_len
     while start < len(truth):
-        for l in reversed(indicators):
-            print(''.join([str(int(b)) for b in l])[start:end])
+        for bits in bit_strings:
+            print(bits[start:end])
         print(predictions[start:end])
         print(truth[start:end])
         print()
@@ -66,24 +73,23 @@ def save_boundaries(truth, predictions, indicators, layers,
     :param path: save path
     :return: None
     """
-    start = 0
-    end = row_len
-    layer_bounds = defaultdict(str)
-    verbose = ""
+    # each layer's string is built once, and every row only slices it
+    bit_strings = [_bit_string(l) for l in reversed(indicators)]
+    verbose = []
     print("Start saving predicted boundaries")
-    while start < len(truth):
-        for i, l in enumerate(reversed(indicators)):
-            if i in layers:
-                layer_bounds[i] += ''.join([str(int(b)) for b in l])[start:end]
-            verbose += ''.join([str(int(b)) for b in l])[start:end] + '\n'
-        verbose += predictions[start:end] + '\n'
-        verbose += truth[start:end] + '\n\n'
-        start = end
-        end += row_len
-
-    for l, v in layer_bounds.items():
-        with open(path + "layer_{}_bound.txt".format(l), 'a') as f:
-            f.write(v)
+    for start in range(0, len(truth), row_len):
+        end = start + row_len
+        for bits in bit_strings:
+            verbose.append(bits[start:end] + '\n')
+        verbose.append(predictions[start:end] + '\n')
+        verbose.append(truth[start:end] + '\n\n')
+
+    # as far as the rows go
+    covered = -(-len(truth) // row_len) * row_len
+    for i, bits in enumerate(bit_strings):
+        if i in layers:
+            with open(path + "layer_{}_bound.txt".format(i), 'a') as f:
+                f.write(bits[:covered])
     with open(path + "compare.txt", 'a') as f:
-        f.write(verbose)
+        f.write(''.join(verbose))
     print("Finished saving one batch")
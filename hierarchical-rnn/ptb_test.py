@@ -1,7 +1,11 @@
-from hmlstm import get_text, save_boundaries
-import os, glob
+from hmlstm import decode_ids, save_boundaries, load_ids, save_indicators, checkpoint_name, VOCAB
+import numpy as np
+import os, glob, sys
 from configuration import *
 
+sys.path.insert(0, '../treebank')
+from evaluate import IncrementalEvaluator, LEVELS_FILE
+
 
 def _rm_obsolete_pred(path):
     for f in glob.glob(path + "*.txt"):
@@ -9,25 +13,80 @@ def _rm_obsolete_pred(path):
 
 
 hparams = select_config()
-batches_in, batches_out = hparams.pre_inputs('../treebank/corpora/sentences.txt', train=False)
+text_path = '../treebank/corpora/sentences.txt'
 network = hparams.gen_network()
+outputs = ('predictions', 'losses', 'indicators')
+variable_path = './text8'
 
 path = "../treebank/"
-# Clear previous prediction outputs
-_rm_obsolete_pred(path)
-
-# Compute mean loss for all batches
-# Note: this may be an approximation towards the mean, because size(last_batch) may be smaller.
-#       However, margin should be trivial for ample num_batches
-tot_loss = 0
-for b in batches_in:
-    predictions, loss = network.predict(b, variable_path='./text8', return_loss=True)
-    tot_loss += loss
-    boundaries = network.predict_boundaries(b)
-    # save layer-wise binary boundary indicators, predicted by the loaded model
-    save_boundaries(get_text(b[0]), get_text(predictions[0]), boundaries[0],
-                    layers=[i for i in range(hparams.num_layers)], path=path)
-tot_loss /= len(batches_in)
+# Boundary metrics and the loss are accumulated in memory as the chunks come
+# in; the text files of save_boundaries are only written if asked for
+# the layers are also scored against the word, phrase and clause boundaries
+# if convert_boundary wrote them
+levels = path + "corpora/" + LEVELS_FILE
+evaluator = IncrementalEvaluator(path + "corpora/boundaries.txt", hparams.num_layers,
+                                 tolerance=hparams.eval_tolerance,
+                                 levels=levels if os.path.exists(levels) else None)
+if hparams.save_boundary_files:
+    # Clear previous prediction outputs
+    _rm_obsolete_pred(path)
+# [num_layers, num_chars] in corpus order, for the indicator store
+corpus_indicators = np.zeros((hparams.num_layers, len(load_ids(text_path))), dtype=bool)
+
+if hparams.eval_sentences:
+    # Whole sentences, each from a zero state, in batches of sentences of
+    # about the same length. Padding is masked out of the losses and the
+    # indicators. The spaces between sentences are never fed to the network,
+    # and are left out of the scores rather than counted as boundaries.
+    batches = hparams.sentence_batches(text_path, train=False)
+    results = (network.infer(b_in, outputs, batch_out=b_out, mask=mask, variable_path=variable_path)
+               for b_in, b_out, mask in batches)
+    weights = batches.masks
+    join = lambda chunks, axis=1, fill=0: batches.join(chunks, axis, fill)
+    inputs = batches.inputs
+else:
+    # The corpus is cut into eval_batch_size rows that are run side by side,
+    # one chunk of truncate_len characters at a time, each chunk starting
+    # from the final state of the one before. Every character but the last
+    # one of the corpus is scored against the next, and padding at the end
+    # of the last row is weighted out of the mean loss.
+    batches = hparams.eval_streams(text_path)
+    results = network.stream(batches.inputs, outputs=outputs,
+                             batches_out=batches.targets, variable_path=variable_path)
+    weights = batches.weights
+    join = lambda chunks, axis=1, fill=0: batches.join(chunks, axis)
+    inputs = batches.inputs
+
+predictions = []
+for i, ((chunk_predictions, losses, chunk_indicators), weight) in enumerate(zip(results, weights)):
+    print('loss:', np.sum(losses * weight) / max(np.sum(weight), 1.))
+    evaluator.add_loss(np.sum(losses * weight), np.sum(weight))
+    if hparams.eval_sentences:
+        positions, mask = batches.positions(i)
+        # [B, L, T] -> [L, characters of the batch]
+        chunk_indicators = np.transpose(chunk_indicators, [1, 0, 2])[:, mask]
+        evaluator.update(positions[mask], chunk_indicators)
+        corpus_indicators[:, positions[mask]] = chunk_indicators > .5
+    else:
+        for start, row_indicators in zip(batches.starts(i), chunk_indicators):
+            evaluator.update_span(start, row_indicators)
+            row_indicators = row_indicators[:, :max(0, corpus_indicators.shape[1] - start)]
+            corpus_indicators[:, start:start + row_indicators.shape[1]] = row_indicators > .5
+    if hparams.save_boundary_files:
+        predictions.append(np.argmax(chunk_predictions, axis=2))
 
-with open("loss.tmp", 'w') as f:
-    f.write(str(tot_loss))
+evaluator.evaluate()
+evaluator.save_eval(path, checkpoint_name(variable_path))
+if hparams.indicator_store:
+    save_indicators(hparams.indicator_store, checkpoint_name(variable_path), corpus_indicators)
+
+if hparams.save_boundary_files:
+    # back in corpus order: [num_chars] and [num_layers, num_chars]
+    truth = decode_ids(join(list(inputs), fill=len(VOCAB) - 1))
+    predictions = decode_ids(join(predictions, fill=len(VOCAB) - 1))
+
+    # save layer-wise binary boundary indicators, predicted by the loaded model
+    for start in range(0, len(truth), hparams.truncate_len):
+        end = start + hparams.truncate_len
+        save_boundaries(truth[start:end], predictions[start:end], corpus_indicators[:, start:end],
+                        layers=[i for i in range(hparams.num_layers)], path=path)
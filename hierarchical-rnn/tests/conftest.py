@@ -0,0 +1,40 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+# the tests import hmlstm from the source tree, as the scripts do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from hmlstm import VOCAB  # noqa: E402
+
+
+@pytest.fixture
+def small_network_factory():
+    """
+    :return: function building a small character HMLSTMNetwork in a graph of
+        its own, returning (graph, network)
+    """
+    tf = pytest.importorskip('tensorflow')
+    from hmlstm import HMLSTMNetwork
+
+    def build(fused_cell=False, num_layers=3, hidden_size=16):
+        graph = tf.Graph()
+        with graph.as_default():
+            network = HMLSTMNetwork(output_size=len(VOCAB), input_size=len(VOCAB),
+                                    num_layers=num_layers,
+                                    embed_size=hidden_size * 2,
+                                    out_hidden_size=hidden_size,
+                                    hidden_state_sizes=hidden_size,
+                                    task='classification', char_ids=True,
+                                    fused_cell=fused_cell)
+            network._get_graph()
+        return graph, network
+
+    return build
+
+
+@pytest.fixture
+def char_batch():
+    rng = np.random.RandomState(0)
+    ids = rng.randint(0, len(VOCAB), size=(4, 41))
+    return ids[:, :-1], ids[:, 1:]
@@ -0,0 +1,47 @@
+import numpy as np
+
+
+def run(graph, network, batch_in, batch_out):
+    '''
+    predictions, loss, indicators and gradients of the trainable variables
+    by name
+    '''
+    import tensorflow as tf
+
+    with graph.as_default():
+        loss = network._get_graph()[1]
+        variables = tf.trainable_variables()
+        gradients = dict(zip([v.op.name for v in variables],
+                             tf.gradients(loss, variables)))
+        predictions, loss, indicators = network.infer(batch_in,
+                                                      batch_out=batch_out)
+        values = network._session.run(
+            gradients, network._feed_dict(batch_in, batch_out))
+    return predictions, loss, indicators, values
+
+
+def test_fused_cell_matches_reference(small_network_factory, char_batch,
+                                      tmp_path):
+    import tensorflow as tf
+
+    variable_path = str(tmp_path / 'model')
+    reference = small_network_factory(fused_cell=False)
+    with reference[0].as_default():
+        reference[1]._session = tf.Session()
+        reference[1]._session.run(tf.global_variables_initializer())
+        reference[1].save_variables(variable_path)
+    fused = small_network_factory(fused_cell=True)
+    with fused[0].as_default():
+        fused[1].load_variables(variable_path)
+
+    expected = run(*(reference + char_batch))
+    actual = run(*(fused + char_batch))
+
+    np.testing.assert_allclose(actual[0], expected[0], rtol=1e-4, atol=1e-5)
+    np.testing.assert_allclose(actual[1], expected[1], rtol=1e-5)
+    np.testing.assert_array_equal(actual[2], expected[2])
+    assert sorted(actual[3]) == sorted(expected[3])
+    for name in expected[3]:
+        scale = np.max(np.abs(expected[3][name])) or 1.
+        assert np.max(np.abs(actual[3][name] - expected[3][name])) / scale \
+            < 1e-4, name
@@ -0,0 +1,63 @@
+import numpy as np
+from hmlstm import NumpyHMLSTM, VOCAB
+
+
+def random_variables(sizes=(16, 12, 8), embed_size=24, out_hidden_size=10,
+                     seed=0):
+    """
+    variables of an HMLSTMNetwork with char_ids, named as save_variables
+    writes them
+    """
+    rng = np.random.RandomState(seed)
+    variables = {}
+    for l, size in enumerate(sizes):
+        h_below = len(VOCAB) if l == 0 else sizes[l - 1]
+        h_above = sizes[(l + 1) % len(sizes)]
+        variables['multi_hmlstm_cell/cell_%d/hmlstm_cell/weights' % l] = \
+            rng.normal(scale=.5, size=(size + h_above + h_below, 4 * size + 1))
+        variables['gates_vars/gate_%d' % l] = rng.normal(size=(sum(sizes), 1))
+    variables['embedding_vars/embed_weights'] = rng.normal(
+        scale=.2, size=(sum(sizes), embed_size))
+    for i, (rows, columns) in enumerate([(embed_size, out_hidden_size),
+                                         (out_hidden_size, out_hidden_size),
+                                         (out_hidden_size, len(VOCAB))], 1):
+        variables['output_module_vars/w%d' % i] = rng.normal(
+            scale=.3, size=(rows, columns))
+        variables['output_module_vars/b%d' % i] = rng.normal(size=columns)
+    return variables
+
+
+def test_skip_copies_matches_dense_run(char_batch):
+    engine = NumpyHMLSTM(random_variables())
+    batch_in = char_batch[0]
+
+    predictions, indicators = engine.run(batch_in)
+    skip_predictions, skip_indicators = engine.run(batch_in, skip_copies=True)
+
+    # the sparse path has to have skipped rows for the test to mean anything
+    assert engine.skip_ratio > 0
+    np.testing.assert_array_equal(skip_indicators, indicators)
+    np.testing.assert_allclose(skip_predictions, predictions,
+                               rtol=1e-5, atol=1e-5)
+
+
+def test_matches_tensorflow_network(small_network_factory, char_batch,
+                                    tmp_path):
+    import tensorflow as tf
+
+    graph, network = small_network_factory()
+    variable_path = str(tmp_path / 'model')
+    with graph.as_default():
+        network._session = tf.Session()
+        network._session.run(tf.global_variables_initializer())
+        network.save_variables(variable_path)
+        predictions, indicators = network.infer(
+            char_batch[0], ('predictions', 'indicators'),
+            variable_path=variable_path)
+
+    np_predictions, np_indicators = NumpyHMLSTM.load(variable_path).run(
+        char_batch[0])
+
+    np.testing.assert_array_equal(np_indicators, indicators)
+    np.testing.assert_allclose(np_predictions, predictions,
+                               rtol=1e-4, atol=1e-4)
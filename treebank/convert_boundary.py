@@ -1,8 +1,22 @@
 from nltk.corpus import treebank
-import re, string
+from nltk.data import FileSystemPathPointer
+from multiprocessing import Pool
+from evaluate import GRANULARITIES, LEVELS_FILE
+import numpy as np
+import re, string, json
 import os, argparse
 
 PUNC_TRANS = str.maketrans({key: None for key in string.punctuation})
+DIGIT = re.compile(r'\d')
+SPACES = re.compile(r' +')
+BINARIFY = re.compile(r'[a-z]', re.IGNORECASE)
+# constituents whose boundaries are clause boundaries, any other one above
+# the part of speech is a phrase
+CLAUSES = ('S', 'SBAR', 'SBARQ', 'SINV', 'SQ')
+
+# bump when the flattened output of a tree changes, to invalidate the cache
+CACHE_VERSION = 2
+CACHE_DIR = 'cache'
 
 
 def _is_punc(word):
@@ -18,68 +32,219 @@ def _check_length_match(boundaries, sentences):
             "Tree {}:\n{}\n{}".format(i, boundaries[i], sentences[i])
 
 
-def _flatten_tree(t, threshold):
-    pos_list = t.pos()
-    if len(pos_list) < threshold:
-        return
-    if _is_punc(pos_list[0][0]):
-        del pos_list[0]
-    if _is_punc(pos_list[-1][0]):
-        del pos_list[-1]
-    sentence = ""
-    phrase = ""
+def _walk_tree(t):
+    """
+    One traversal of a tree, leaving out punctuation.
+    :return: the (word, pos) of its words, and the granularity of the
+        boundary between each two consecutive words: 1 between words, 2 if
+        a phrase starts or ends there and 3 for a clause, see GRANULARITIES
+    """
+    words = []
+    # highest granularity of the constituents starting and ending at a word
+    starts, ends = [], []
+
+    def visit(node):
+        if len(node) == 1 and isinstance(node[0], str):
+            if _is_punc(node[0]):
+                return None
+            words.append((node[0], node.label()))
+            starts.append(1)
+            ends.append(1)
+            return len(words) - 1, len(words) - 1
+        spans = [span for span in map(visit, node) if span]
+        if not spans:
+            return None
+        first, last = spans[0][0], spans[-1][1]
+        # e.g. 'S-TPC-1' or 'NP-SBJ=2'
+        label = re.split(r'[-=]', node.label())[0]
+        level = 3 if label in CLAUSES else 2
+        starts[first] = max(starts[first], level)
+        ends[last] = max(ends[last], level)
+        return first, last
+
+    visit(t)
+    gaps = [max(ends[i], starts[i + 1]) for i in range(len(words) - 1)]
+    return words, gaps
+
+
+def _flatten_tree(t):
+    """
+    :return: the '0'/'1' string of a change of part of speech between
+        words, and the granularities of the boundaries, see _walk_tree
+    """
+    words, gaps = _walk_tree(t)
+    # words of consecutive tokens with the same part of speech
+    phrases = []
     last_pos = ""
-    for word, pos in pos_list:
-        if _is_punc(word):
-            continue
-        word = re.sub(r'\d', 'x', word)
+    for word, pos in words:
+        word = DIGIT.sub('x', word)
         if last_pos != pos:
-            if last_pos:
-                sentence += phrase + '1'
-            phrase = word
+            phrases.append([word])
             last_pos = pos
         else:
-            phrase += '0' + word
-    sentence += phrase
+            phrases[-1].append(word)
+    sentence = '1'.join('0'.join(phrase) for phrase in phrases)
 
     sentence = sentence.translate(PUNC_TRANS)
-    binarify = re.compile(r'[a-z]', re.IGNORECASE)
-    return binarify.sub('0', sentence)
+    return BINARIFY.sub('0', sentence), gaps
 
 
-def gen_corpus(path, threshold):
+def _flatten_file(fileid):
+    """
+    :return: [number of tokens, boundaries, sentence, granularities] of
+        every tree of the file, with no threshold applied
+    """
+    trees = []
+    for t in treebank.parsed_sents(fileid):
+        sentence = ' '.join(t.leaves()).translate(PUNC_TRANS).lower()
+        sentence = SPACES.sub(' ', sentence)
+        # replace digit(s) as 'x'(s)
+        sentence = DIGIT.sub('x', sentence).strip()
+        flat, gaps = _flatten_tree(t)
+        trees.append([len(t.leaves()), flat, sentence, gaps])
+    return trees
+
+
+def _source_mtime(fileid):
+    pointer = treebank.abspath(fileid)
+    if isinstance(pointer, FileSystemPathPointer):
+        return os.path.getmtime(pointer.path)
+    # an entry of the corpus' zip file
+    return os.path.getmtime(pointer.zipfile.filename)
+
+
+def _load_cached(cache_path, fileid):
+    """
+    :return: the cached trees of fileid, or None if missing or stale
+    """
+    try:
+        with open(cache_path) as f:
+            cached = json.load(f)
+    except (IOError, ValueError):
+        return None
+    if cached.get('version') != CACHE_VERSION or \
+            cached.get('mtime') != _source_mtime(fileid):
+        return None
+    return cached['trees']
+
+
+def _convert_file(args):
+    fileid, cache_path = args
+    trees = _flatten_file(fileid)
+    if cache_path:
+        with open(cache_path + '.tmp', 'w') as f:
+            json.dump({'version': CACHE_VERSION, 'mtime': _source_mtime(fileid),
+                       'trees': trees}, f)
+        os.replace(cache_path + '.tmp', cache_path)
+    return trees
+
+
+def flatten_files(fileids, cache_dir=None, processes=None):
+    """
+    Flatten the trees of each file, reusing the results cached in cache_dir
+    from an earlier run if the file has not changed since. The others are
+    converted in parallel on a pool of processes and cached.
+
+    :param fileids: treebank files, in corpus order
+    :param cache_dir: directory of the per-file cache, None not to cache
+    :param processes: size of the pool, the number of CPUs by default
+    :return: list of the trees of each file, see _flatten_file
+    """
+    if cache_dir and not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    cache_paths = [os.path.join(cache_dir, fileid + '.json') if cache_dir else None
+                   for fileid in fileids]
+    files = [_load_cached(p, fileid) if p else None
+             for fileid, p in zip(fileids, cache_paths)]
+
+    missing = [i for i, trees in enumerate(files) if trees is None]
+    if missing:
+        jobs = [(fileids[i], cache_paths[i]) for i in missing]
+        if len(jobs) == 1 or processes == 1:
+            converted = map(_convert_file, jobs)
+        else:
+            pool = Pool(processes)
+            converted = pool.map(_convert_file, jobs)
+            pool.close()
+            pool.join()
+        for i, trees in zip(missing, converted):
+            files[i] = trees
+    print("{} of {} files from the cache".format(len(fileids) - len(missing), len(fileids)))
+    return files
+
+
+def _level_string(sentence, gaps):
+    """
+    :return: the granularity of each character of a sentence as a digit:
+        0 within words, and that of the boundary at the spaces between them
+    """
+    words = sentence.split(' ')
+    assert len(words) == len(gaps) + 1, sentence
+    return ''.join('0' * len(word) + str(gap)
+                   for word, gap in zip(words, gaps)) + '0' * len(words[-1])
+
+
+def gen_corpus(path, threshold, fileids=None, processes=None, cache=True):
     """
     src: http://www.nltk.org/_modules/nltk/tree.html
     corpora from wsj_0001.mrg to wsj_0199.mrg
     e.g.: t = treebank.parsed_sents('wsj_0001.mrg')[0]
     to visualize a tree: t.draw()
+
+    The flattened trees of each file are cached under path, regardless of
+    the threshold, which is applied when joining them: a rerun with another
+    threshold or a subset of the files only reads the cache.
     :param path: save to path
     :param threshold: minimum length of a sentence to keep
+    :param fileids: treebank files to convert, all of them by default
+    :param processes: number of processes converting files that are not cached
+    :param cache: whether to read and write the per-file cache
     :return: none
     """
+    if fileids is None:
+        fileids = treebank.fileids()
+    cache_dir = os.path.join(path, CACHE_DIR) if cache else None
     boundaries = []
     sentences = []
-    for t in treebank.parsed_sents(treebank.fileids()):
-        flat = _flatten_tree(t, threshold)
-        if flat:
-            boundaries.append(flat)
-            sentence = ' '.join(t.leaves()).translate(PUNC_TRANS).lower()
-            sentence = re.sub(r' +', ' ', sentence)
-            # replace digit(s) as 'x'(s)
-            sentences.append(re.sub(r'\d', 'x', sentence).strip())
+    levels = []
+    for trees in flatten_files(fileids, cache_dir, processes):
+        for num_tokens, flat, sentence, gaps in trees:
+            if num_tokens >= threshold and flat:
+                boundaries.append(flat)
+                sentences.append(sentence)
+                levels.append(_level_string(sentence, gaps))
     _check_length_match(boundaries, sentences)
     with open(path + "/boundaries.txt", 'w') as f:
         f.write('1'.join(boundaries))
     with open(path + "/sentences.txt", 'w') as f:
         f.write(' '.join(sentences))
+    # (start, end) of each sentence in sentences.txt, for batching whole
+    # sentences, see hmlstm.SentenceBatches
+    with open(path + "/sentences.offsets", 'w') as f:
+        start = 0
+        for sentence in sentences:
+            f.write("{} {}\n".format(start, start + len(sentence)))
+            start += len(sentence) + 1
+    # [granularity, num_chars] boundaries of words, phrases and clauses, see
+    # evaluate.read_levels; the spaces between sentences are all of them
+    levels = str(len(GRANULARITIES)).join(levels).encode()
+    levels = np.frombuffer(levels, dtype=np.uint8) - ord('0')
+    granularity = np.arange(1, len(GRANULARITIES) + 1)[:, None]
+    np.save(os.path.join(path, LEVELS_FILE), (levels >= granularity).astype(np.int8))
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--path', action='store', dest='path', default='corpora',
                         help='output path for storing generated corpus')
-    parser.add_argument('--threshold', action='store', dest='threshold', default=5,
+    parser.add_argument('--threshold', action='store', dest='threshold', default=5, type=int,
                         help='minimum number of tokens (including word and punctuation) in a sentence')
+    parser.add_argument('--fileids', action='store', dest='fileids', nargs='+', default=None,
+                        help='treebank files to convert, e.g. wsj_0001.mrg; all of them by default')
+    parser.add_argument('--processes', action='store', dest='processes', default=None, type=int,
+                        help='number of processes for the files that are not cached')
+    parser.add_argument('--no_cache', action='store_false', dest='cache',
+                        help='neither read nor write the per-file cache')
     options = parser.parse_args()
 
     if not os.path.exists(options.path):
@@ -1,10 +1,305 @@
-from sklearn.metrics import precision_recall_fscore_support
 import numpy as np
 from collections import defaultdict
 import glob
 import pickle
+import tempfile
 import time, datetime
-import os
+import os, argparse
+
+AVERAGES = (None, 'binary', 'macro', 'micro', 'weighted')
+# rows of the ground truth written by convert_boundary next to boundaries.txt
+GRANULARITIES = ('word', 'phrase', 'clause')
+LEVELS_FILE = 'boundary_levels.npy'
+
+
+def dilate(boundaries, k):
+    """
+    Mark everything within k characters of a boundary.
+
+    :param boundaries: bool array, [..., n]
+    :param k: integer, tolerance in characters
+    :return: bool array, [..., n]
+    """
+    if k == 0:
+        return boundaries
+    # number of boundaries in [i - k, i + k], from a cumulative sum
+    n = boundaries.shape[-1]
+    counts = np.cumsum(boundaries, axis=-1, dtype=np.int64)
+    counts = np.concatenate(
+        [np.zeros(boundaries.shape[:-1] + (1,), dtype=np.int64), counts],
+        axis=-1)
+    upper = np.minimum(np.arange(n) + k + 1, n)
+    lower = np.maximum(np.arange(n) - k, 0)
+    return counts[..., upper] - counts[..., lower] > 0
+
+
+def boundary_counts(truth, predictions, tolerance=0, valid=None):
+    """
+    Counts of the boundary (1) and non-boundary (0) classes, for all layers
+    at once, or for all granularities of the truth and all layers at once
+    with a truth of [num_granularities, 1, n].
+
+    With a tolerance, a predicted boundary is a hit if there is a boundary
+    in the truth within tolerance characters of it, and a boundary of the
+    truth is found if a boundary is predicted within tolerance characters of
+    it. The non-boundary class is always exact.
+
+    :param truth: bool array, [n], or any shape broadcasting with predictions
+    :param predictions: bool array, [num_layers, n]
+    :param tolerance: integer, in characters
+    :param valid: optional bool array, [num_layers, n], of the positions to
+        score, e.g. when the layers have fewer predictions than the truth
+    :return: int64 arrays of [num_layers, 2], or the broadcast shape of
+        truth and predictions but the last axis followed by 2, for class 0
+        and 1: the predictions that are hits, the predictions, the truths
+        that are found and the truths
+    """
+    shape = np.broadcast(truth, predictions).shape
+    truth = np.broadcast_to(truth, shape)
+    predictions = np.broadcast_to(predictions, shape)
+    if valid is None:
+        valid = np.ones(shape, dtype=bool)
+    valid = np.broadcast_to(valid, shape)
+    predictions = predictions & valid
+    truth = truth & valid
+
+    def count(x):
+        return np.sum(x, axis=-1, dtype=np.int64)
+
+    num_valid = count(valid)
+    neither = count(valid & ~predictions & ~truth)
+    num_predicted = count(predictions)
+    num_true = count(truth)
+
+    predicted_hits = np.stack(
+        [neither, count(predictions & dilate(truth, tolerance))], axis=-1)
+    predicted = np.stack([num_valid - num_predicted, num_predicted], axis=-1)
+    true_hits = np.stack(
+        [neither, count(truth & dilate(predictions, tolerance))], axis=-1)
+    true = np.stack([num_valid - num_true, num_true], axis=-1)
+    return predicted_hits, predicted, true_hits, true
+
+
+def scores_from_counts(predicted_hits, predicted, true_hits, true,
+                       average=None):
+    """
+    Precision, recall, F1 and support from counts, as sklearn's
+    precision_recall_fscore_support with labels 0 and 1: ill-defined values
+    are 0, and the support is None for averages.
+
+    :param predicted_hits, predicted, true_hits, true: [num_layers, 2]
+        counts, see boundary_counts
+    :param average: one of AVERAGES
+    :return: a list of (precision, recall, f1, support) per layer; arrays
+        of the two classes if average is None, floats otherwise
+    """
+    if average not in AVERAGES:
+        raise ValueError('average has to be one of %s' % (AVERAGES,))
+
+    def divide(a, b):
+        a, b = np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64)
+        return np.where(b > 0, a / np.where(b > 0, b, 1.), 0.)
+
+    support = true
+    if average == 'micro':
+        predicted_hits, predicted, true_hits, true = [
+            np.sum(x, axis=-1, keepdims=True)
+            for x in (predicted_hits, predicted, true_hits, true)]
+    precision = divide(predicted_hits, predicted)
+    recall = divide(true_hits, true)
+    f1 = divide(2 * precision * recall, precision + recall)
+
+    if average is None:
+        return [(p, r, f, s) for p, r, f, s
+                in zip(precision, recall, f1, support)]
+    if average == 'binary':
+        precision, recall, f1 = precision[:, 1], recall[:, 1], f1[:, 1]
+    elif average == 'macro':
+        precision, recall, f1 = [np.mean(x, axis=-1)
+                                 for x in (precision, recall, f1)]
+    elif average == 'weighted':
+        weights = divide(support, np.sum(support, axis=-1, keepdims=True))
+        precision, recall, f1 = [np.sum(x * weights, axis=-1)
+                                 for x in (precision, recall, f1)]
+    else:
+        precision, recall, f1 = precision[:, 0], recall[:, 0], f1[:, 0]
+    return [(float(p), float(r), float(f), None)
+            for p, r, f in zip(precision, recall, f1)]
+
+
+def read_boundaries(path):
+    """
+    :param path: file of '0'/'1' characters
+    :return: bool array, True for '1'
+    """
+    with open(path, 'rb') as f:
+        return np.frombuffer(f.read().strip(), dtype=np.uint8) == ord('1')
+
+
+def read_levels(path):
+    """
+    :param path: the LEVELS_FILE written by convert_boundary
+    :return: bool array, [len(GRANULARITIES), n], the boundaries of each
+        granularity, e.g. every phrase boundary is a word boundary too
+    """
+    return np.load(path) > 0
+
+
+def granularity_scores(truth_levels, predictions, names, tolerance=0,
+                       valid=None, average=None):
+    """
+    Score every layer against every granularity of the truth in one sweep.
+
+    :param truth_levels: bool array, [len(GRANULARITIES), n], see read_levels
+    :param predictions: bool array, [num_layers, n]
+    :param names: the keys of the layers
+    :param valid, tolerance: see boundary_counts
+    :param average: see scores_from_counts
+    :return: {granularity: {layer name: (precision, recall, f1, support)}}
+    """
+    counts = boundary_counts(truth_levels[:, None], predictions[None],
+                             tolerance, valid)
+    return _granularity_dict(counts, names, average)
+
+
+def _granularity_dict(counts, names, average):
+    # [G, L, 2] counts scored as G * L layers
+    flat = [c.reshape(-1, 2) for c in counts]
+    scores = iter(scores_from_counts(*flat, average=average))
+    return {g: {name: next(scores) for name in names} for g in GRANULARITIES}
+
+
+def save_results(results, path='.', name=None):
+    """
+    Pickle evaluation results to a new eval_[<name>_]<timestamp>_*.pkl file
+    under path. The file name is unique, so evaluations of other runs or
+    checkpoints never overwrite each other, even within the same second.
+
+    :param name: e.g. the checkpoint name, to tell the files apart
+    :return: path of the file
+    """
+    print(results)
+    timestamp = datetime.datetime.fromtimestamp(time.time()).strftime('%m-%d-%H%M%S')
+    prefix = "eval_{}{}_".format(name + "_" if name else "", timestamp)
+    fd, file_path = tempfile.mkstemp(suffix=".pkl", prefix=prefix, dir=path)
+    with os.fdopen(fd, 'wb') as f:
+        pickle.dump(results, f)
+    return file_path
+
+
+class IncrementalEvaluator(object):
+    """
+    Boundary metrics and BPC accumulated from indicator arrays as inference
+    produces them, in any order, without the layer_*.txt and loss.tmp
+    files of EvaluateBoundary.
+
+    Results are keyed like EvaluateBoundary's: 'layer_{i}_bound.txt' is
+    the i-th layer from the top, as written by viz.save_boundaries.
+    """
+    def __init__(self, truth, num_layers, tolerance=0, levels=None):
+        """
+        :param truth: bool array of the ground-truth boundaries, or the path
+            of the boundary file
+        :param num_layers: number of layers of the network
+        :param tolerance: see boundary_counts
+        :param levels: optional bool array of the boundaries of each of
+            GRANULARITIES, or the path of the LEVELS_FILE, to also score the
+            layers against, see EvaluateBoundary
+        """
+        if isinstance(truth, str):
+            truth = read_boundaries(truth)
+        if isinstance(levels, str):
+            levels = read_levels(levels)
+        self.truth = truth
+        self.levels = levels
+        self.tolerance = tolerance
+        self.names = ['layer_{}_bound.txt'.format(i) for i in range(num_layers)]
+        # [1 + num_granularities, n], the truth then the levels if any
+        self._truths = truth[None] if levels is None else \
+            np.concatenate([truth[None], levels[:, :len(truth)]])
+        self._dilated_truths = dilate(self._truths, tolerance)
+        # [num_layers, n], truths within tolerance of a prediction so far
+        self._found = np.zeros((num_layers, len(truth)), dtype=bool)
+        self._counts = np.zeros((4, len(self._truths), num_layers), dtype=np.int64)
+        self._scored = np.zeros(len(truth), dtype=bool)
+        self._loss_sum = 0.
+        self._num_scored = 0.
+
+    def update(self, positions, indicators):
+        """
+        :param positions: int array, [m], positions in the corpus
+        :param indicators: [num_layers, m] indicators at those positions,
+            bottom layer first as returned by the network
+        """
+        positions = np.asarray(positions)
+        predictions = np.asarray(indicators)[::-1] > .5     # top layer first
+        truths = self._truths[:, None, positions]           # [T, 1, m]
+        self._counts += np.stack(np.broadcast_arrays(
+            np.sum(predictions, axis=1),
+            np.sum(predictions & self._dilated_truths[:, None, positions], axis=-1),
+            np.sum(~predictions & ~truths, axis=-1),
+            len(positions),
+        ))
+        self._scored[positions] = True
+        for shift in range(-self.tolerance, self.tolerance + 1):
+            # shifts past the ends of the corpus find nothing, rather than
+            # being clipped onto the first or last position; logical_or.at
+            # as a position may still come more than once
+            shifted = positions + shift
+            inside = (shifted >= 0) & (shifted < len(self.truth))
+            np.logical_or.at(self._found, (slice(None), shifted[inside]),
+                             predictions[:, inside])
+
+    def update_span(self, start, indicators):
+        """
+        :param start: position in the corpus of the first indicator
+        :param indicators: [num_layers, m] indicators of consecutive
+            positions, bottom layer first; the ones past the end of the
+            corpus are ignored
+        """
+        indicators = np.asarray(indicators)[:, :max(0, len(self.truth) - start)]
+        self.update(np.arange(start, start + indicators.shape[1]), indicators)
+
+    def add_loss(self, loss_sum, num_scored):
+        """
+        :param loss_sum: summed loss of num_scored characters, in nats
+        """
+        self._loss_sum += loss_sum
+        self._num_scored += num_scored
+
+    def evaluate(self, average=None):
+        """
+        :param average: see EvaluateBoundary.evaluate
+        :return: the same dictionary as EvaluateBoundary.evaluate, with
+            'bpc' the mean loss per character in nats
+        """
+        num_predicted, predicted_hits, neither, num_scored = self._counts
+        # truths at the positions scored so far, [T, 1, n]
+        truths = (self._truths & self._scored)[:, None]
+        num_true = np.broadcast_to(np.sum(truths, axis=-1), num_scored.shape)
+        true_found = np.sum(truths & self._found, axis=-1)
+
+        counts = (
+            np.stack([neither, predicted_hits], axis=-1),
+            np.stack([num_scored - num_predicted, num_predicted], axis=-1),
+            np.stack([neither, true_found], axis=-1),
+            np.stack([num_scored - num_true, num_true], axis=-1),
+        )
+        self.prec_recall_f1 = defaultdict(tuple)
+        for name, scores in zip(self.names, scores_from_counts(
+                *[c[0] for c in counts], average=average)):
+            self.prec_recall_f1[name] = scores
+        if self.levels is not None:
+            self.prec_recall_f1['granularities'] = _granularity_dict(
+                [c[1:] for c in counts], self.names, average)
+        self.prec_recall_f1['bpc'] = self._loss_sum / max(self._num_scored, 1.)
+        return self.prec_recall_f1
+
+    def save_eval(self, path='.', name=None):
+        """
+        :return: path of the pickled results, see save_results
+        """
+        return save_results(self.prec_recall_f1, path, name)
 
 
 class EvaluateBoundary(object):
@@ -12,27 +307,37 @@ class EvaluateBoundary(object):
     Metrics: precision/recall, F1
     Ground-truth: Penn Treebank
     """
-    def __init__(self, file_truth, file_layers_predict):
+    def __init__(self, file_truth, file_layers_predict, tolerance=0,
+                 file_levels=None):
+        """
+        :param file_truth: ground-truth boundary file
+        :param file_layers_predict: glob of the layer-wise predicted boundary
+            files
+        :param tolerance: a boundary within this many characters counts as
+            a hit, see boundary_counts
+        :param file_levels: optional LEVELS_FILE of the word, phrase and
+            clause boundaries, to also score every layer against each of
+            GRANULARITIES
+        """
         self.file_truth = file_truth
         self.file_layers_predict = file_layers_predict
+        self.tolerance = tolerance
+        self.file_levels = file_levels
         self._get_labels()
 
     def _get_labels(self):
-        labelize = lambda bounds: np.array(list(bounds.strip()))
-
-        with open(self.file_truth, 'r') as f:
-            self.truth = labelize(f.read())
+        self.truth = read_boundaries(self.file_truth)
+        self.levels = read_levels(self.file_levels) if self.file_levels else None
 
         self.pred_layers = defaultdict()
-        for f in glob.glob(self.file_layers_predict):
-            with open(f, 'r') as file:
-                self.pred_layers[f] = labelize(file.read())
-                if len(self.pred_layers[f]) > len(self.truth):
-                    raise Exception("More predicted points than truth.")
+        for f in sorted(glob.glob(self.file_layers_predict)):
+            self.pred_layers[f] = read_boundaries(f)
+            if len(self.pred_layers[f]) > len(self.truth):
+                raise Exception("More predicted points than truth.")
 
         return self.truth, self.pred_layers
 
-    def evaluate(self, average=None, read_loss=True):
+    def evaluate(self, average=None, bpc=None):
         """ Evaluate predictions for each layer of (precision, recall, f1, support), and BPC for LM
 
         For example, for a 3-layer model, it outputs:
@@ -47,38 +352,54 @@ class EvaluateBoundary(object):
             'layer_1_bound_filename': (...),
             'layer_2_bound_filename': (...)
         }
-        :param average: same as http://scikit-learn.org/stable/modules/generated/sklearn.metrics.precision_recall_fscore_support.html
+        :param average: one of None, 'binary', 'macro', 'micro' and 'weighted', same as
+            http://scikit-learn.org/stable/modules/generated/sklearn.metrics.precision_recall_fscore_support.html
+        :param bpc: the bpc of the run that predicted the layers, e.g. from
+            the results ptb_test.py saved, to keep with the scores
         :return: a dictionary with 1. layer as key, (precision, recall, f1, support) as value
                     (each element contains two values for (0, 1));
-                 2. 'bpc' as key, and its bpc score
+                 2. with bpc, 'bpc' as key, and its bpc score;
+                 3. with file_levels, 'granularities' as key, and
+                    {granularity: {layer: (precision, recall, f1, support)}}
         """
         self.prec_recall_f1 = defaultdict(tuple)
-        for l, layer_pred in self.pred_layers.items():
-            precision, recall, f1, support = precision_recall_fscore_support(
-                self.truth[:len(self.pred_layers[l])], self.pred_layers[l], average=average)
-            self.prec_recall_f1[l] = (precision, recall, f1, support)
-
-        if read_loss:
-            self._read_loss()
-        else:
-            return self.prec_recall_f1
-
-    def _read_loss(self):
-        try:
-            with open("../hierarchical-rnn/loss.tmp", 'r') as f:
-                loss = float(f.read())
-        except:
-            raise
-        os.remove("../hierarchical-rnn/loss.tmp")
-        self.prec_recall_f1["bpc"] = loss
-
-    def save_eval(self):
-        print(self.prec_recall_f1)
-        timestamp = datetime.datetime.fromtimestamp(time.time()).strftime('%m-%d-%H%M%S')
-        pickle.dump(self.prec_recall_f1, open("eval_{}.pkl".format(timestamp), 'wb'))
+        # all layers in one [num_layers, n] sweep; each layer is scored
+        # against as much of the truth as it has predictions for
+        layers = list(self.pred_layers)
+        predictions = np.zeros((len(layers), len(self.truth)), dtype=bool)
+        valid = np.zeros_like(predictions)
+        for i, l in enumerate(layers):
+            predictions[i, :len(self.pred_layers[l])] = self.pred_layers[l]
+            valid[i, :len(self.pred_layers[l])] = True
+        counts = boundary_counts(self.truth, predictions, self.tolerance, valid)
+        for l, scores in zip(layers, scores_from_counts(*counts, average=average)):
+            self.prec_recall_f1[l] = scores
+        if self.levels is not None:
+            self.prec_recall_f1['granularities'] = granularity_scores(
+                self.levels[:, :len(self.truth)], predictions, layers,
+                self.tolerance, valid, average)
+
+        if bpc is not None:
+            self.prec_recall_f1["bpc"] = bpc
+        return self.prec_recall_f1
+
+    def save_eval(self, path='.', name=None):
+        """
+        :return: path of the pickled results, see save_results
+        """
+        return save_results(self.prec_recall_f1, path, name)
 
 
 if __name__ == '__main__':
-    eval_label = EvaluateBoundary("corpora/boundaries.txt", "layer_*.txt")
-    eval_label.evaluate()
-    eval_label.save_eval()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--bpc', type=float, default=None,
+                        help='bpc of the run that wrote the layer files, to keep with the scores')
+    parser.add_argument('--name', default=None,
+                        help='e.g. the checkpoint name, part of the name of the saved results')
+    options = parser.parse_args()
+
+    levels = os.path.join("corpora", LEVELS_FILE)
+    eval_label = EvaluateBoundary("corpora/boundaries.txt", "layer_*.txt",
+                                  file_levels=levels if os.path.exists(levels) else None)
+    eval_label.evaluate(bpc=options.bpc)
+    eval_label.save_eval(name=options.name)
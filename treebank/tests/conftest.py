@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the tests import evaluate from the source tree, as ptb_test.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
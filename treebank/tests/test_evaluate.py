@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from evaluate import IncrementalEvaluator, boundary_counts, scores_from_counts
+
+
+def batch_scores(truth, predictions, tolerance):
+    counts = boundary_counts(truth, predictions, tolerance)
+    return scores_from_counts(*counts)
+
+
+@pytest.mark.parametrize('tolerance', [0, 1, 2])
+def test_incremental_matches_batch_at_the_corpus_ends(tolerance):
+    truth = np.array([1, 0, 0, 0, 0, 0, 0, 1], dtype=bool)
+    # [num_layers, n], top layer first: boundaries within tolerance of the
+    # first and last positions, and on them
+    predictions = np.array([[0, 1, 0, 0, 0, 0, 1, 0],
+                            [1, 0, 0, 0, 0, 0, 0, 1],
+                            [0, 0, 0, 1, 0, 0, 0, 0]], dtype=bool)
+    evaluator = IncrementalEvaluator(truth, len(predictions), tolerance)
+    # bottom layer first, as the network returns them
+    evaluator.update(np.arange(len(truth)), predictions[::-1])
+    results = evaluator.evaluate()
+
+    for name, expected in zip(evaluator.names,
+                              batch_scores(truth, predictions, tolerance)):
+        for actual_value, expected_value in zip(results[name], expected):
+            np.testing.assert_allclose(actual_value, expected_value)
+
+
+def test_prediction_within_tolerance_of_the_last_position():
+    truth = np.array([0, 0, 0, 0, 1], dtype=bool)
+    predictions = np.array([[0, 0, 0, 1, 0]], dtype=bool)
+    evaluator = IncrementalEvaluator(truth, 1, tolerance=1)
+    evaluator.update(np.arange(len(truth)), predictions)
+    precision, recall, _, _ = evaluator.evaluate()['layer_0_bound.txt']
+    assert precision[1] == 1.
+    assert recall[1] == 1.
+
+
+def test_updates_in_any_order_match_one_update():
+    rng = np.random.RandomState(0)
+    truth = rng.rand(500) < .2
+    predictions = rng.rand(3, 500) < .2
+    evaluator = IncrementalEvaluator(truth, 3, tolerance=2)
+    for chunk in np.array_split(rng.permutation(500), 7):
+        evaluator.update(chunk, predictions[::-1][:, chunk])
+    results = evaluator.evaluate()
+
+    for name, expected in zip(evaluator.names,
+                              batch_scores(truth, predictions, 2)):
+        for actual_value, expected_value in zip(results[name], expected):
+            np.testing.assert_allclose(actual_value, expected_value)